@@ -0,0 +1,200 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "data_ingestion", "transformation_scripts"))
+sys.path.insert(0, os.path.join(HERE, "..", "data_ingestion"))
+
+import fixtures
+from horse_results_preprocesser import category_vocab, process_chunk, read_horse_results
+from races_preprocesser import transform_races
+
+BASELINE = os.path.join(HERE, "baseline.json")
+
+
+def load_scraper():
+    # scraper-race.py isn't importable by name
+    spec = importlib.util.spec_from_file_location("scraper_race", os.path.join(HERE, "..", "data_ingestion",
+                                                                               "scraper-race.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn):
+    # run() for measure(): seconds the whole call took
+    def run():
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+    return run
+
+
+def measure(run, items: int, repeat: int, min_seconds: float = 0.2) -> dict:
+    """Best-of-`repeat` throughput of run(), which handles `items` items and
+    returns the seconds to count, and the peak memory Python allocated during
+    one more, traced, call.
+
+    Quick calls are looped until each timing covers at least min_seconds, so
+    timer and scheduler noise stays small next to what is measured.
+    """
+    loops = math.ceil(min_seconds / max(run(), 1e-9))
+    best = min(sum(run() for _ in range(loops)) for _ in range(repeat)) / loops
+
+    # traced separately: tracemalloc slows allocation-heavy code down several times
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"rate": items / best, "seconds": best, "peak_mb": peak / 1e6}
+
+
+def quiet(fn):
+    # the transforms print value counts and frames as they go; keep the report readable
+    def run(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn(*args, **kwargs)
+    return run
+
+
+def scraper_benchmarks(repeat: int) -> dict:
+    scraper = load_scraper()
+    races = list(fixtures.load_pages().values())
+    pages = [body for race in races for body in race.values()]
+    results = {}
+
+    for backend, (parse, parse_details, parse_results, parse_overview, parse_form) in scraper.PARSERS.items():
+        # each process_* gets pages parsed beforehand, so it is timed on its own
+        parsed = [{page: parse(body) for page, body in race.items()} for race in races]
+        cases = {
+            "parse_page": (lambda: [parse(body) for body in pages], len(pages)),
+            "process_race_details": (lambda: [parse_details(race["results"]) for race in parsed], len(parsed)),
+            "process_results": (lambda: [parse_results(race["results"]) for race in parsed], len(parsed)),
+            "process_overview": (lambda: [parse_overview(race["overview"]) for race in parsed], len(parsed)),
+            "process_form": (lambda: [parse_form(race["full-form"]) for race in parsed], len(parsed)),
+            # all three pages to rows, as the scraper does per race
+            "build_race_rows": (lambda: [scraper.build_race_rows(race["results"], race["overview"], race["full-form"],
+                                                                 backend) for race in races], len(races) * 3),
+        }
+        for name, (run, items) in cases.items():
+            results[f"scraper.{backend}.{name}"] = {**measure(timed(run), items, repeat), "unit": "pages/s"}
+    return results
+
+
+def transform_benchmarks(raw_path: str, chunk_size: int, repeat: int) -> dict:
+    raw_conn = sqlite3.connect(raw_path)
+    vocab = category_vocab(raw_conn)
+    rows = raw_conn.execute("SELECT count(*) FROM horse_results").fetchone()[0]
+    races = raw_conn.execute("SELECT count(*) FROM races").fetchone()[0]
+
+    def run_chunks():
+        # streamed as transform_horse_results does, so a million rows fit; only process_chunk is
+        # timed, but the traced peak includes the raw chunk it is given
+        spent = 0
+        for chunk in read_horse_results(raw_conn, chunk_size):
+            start = time.perf_counter()
+            process_chunk(chunk, vocab)
+            spent += time.perf_counter() - start
+        return spent
+
+    results = {
+        "transform.process_chunk": {**measure(quiet(run_chunks), rows, repeat), "unit": "rows/s"},
+        # reads its own races, so this includes the query
+        "transform.transform_races": {**measure(timed(quiet(partial(transform_races, raw_conn))), races, repeat),
+                                      "unit": "races/s"},
+    }
+    raw_conn.close()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Benchmarks slower, or peaking higher, than the baseline by more than threshold."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["rate"] < base["rate"] * (1 - threshold):
+            regressions.append(f"{name}: {result['rate']:,.0f} {result['unit']} vs {base['rate']:,.0f}")
+        # + 1 MB: a few hundred kB either way on a small peak is noise
+        if result["peak_mb"] > base["peak_mb"] * (1 + threshold) + 1:
+            regressions.append(f"{name}: peak {result['peak_mb']:.1f} MB vs {base['peak_mb']:.1f} MB")
+    return regressions
+
+
+def report(results: dict, baseline: dict):
+    print(f"{'benchmark':<40} {'throughput':>18} {'vs base':>8} {'peak MB':>9} {'vs base':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        rate_change = f"{result['rate'] / base['rate'] - 1:+.0%}" if base else ""
+        peak_change = f"{result['peak_mb'] / base['peak_mb'] - 1:+.0%}" if base and base["peak_mb"] else ""
+        print(f"{name:<40} {result['rate']:>10,.0f} {result['unit']:<7} {rate_change:>8} "
+              f"{result['peak_mb']:>9.1f} {peak_change:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and peak memory of the page parsers and transforms")
+    parser.add_argument("--races", type=int, default=2000,
+                        help="races in the synthetic raw db (about 11 runners each; 100000 is ~1.1M rows)")
+    parser.add_argument("--seed", type=int, default=1, help="synthetic raw db seed")
+    parser.add_argument("--chunk-size", type=int, default=25000, help="horse_results rows per process_chunk call")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark; the best is kept")
+    parser.add_argument("--only", choices=["scraper", "transform"], help="run one group of benchmarks")
+    parser.add_argument("--threshold", type=float,
+                        help="allowed slowdown / memory growth vs the baseline (default: the baseline's own)")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write these results to {BASELINE}")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    workload = {"races": args.races, "seed": args.seed, "chunk_size": args.chunk_size,
+                "pages": sorted(os.listdir(fixtures.PAGE_FIXTURES))}
+    results = {}
+    if args.only in (None, "scraper"):
+        results.update(scraper_benchmarks(args.repeat))
+    if args.only in (None, "transform"):
+        results.update(transform_benchmarks(fixtures.raw_db(args.races, args.seed), args.chunk_size, args.repeat))
+
+    baseline = {"workload": None, "threshold": 0.25, "results": {}}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+    threshold = args.threshold if args.threshold is not None else baseline["threshold"]
+    # throughput from another workload isn't comparable
+    base_results = baseline["results"] if baseline["workload"] == workload else {}
+    if baseline["results"] and not base_results:
+        print("Baseline was recorded on a different workload, not comparing")
+
+    report(results, base_results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"workload": workload, "results": results}, f, indent=2)
+
+    if args.save_baseline:
+        # keep entries for benchmarks not run this time (--only)
+        saved = {**base_results, **results}
+        with open(BASELINE, "w") as f:
+            json.dump({"workload": workload, "threshold": threshold, "machine": platform.machine(),
+                       "python": platform.python_version(), "results": saved}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {BASELINE}")
+        sys.exit(0)
+
+    regressions = compare(results, base_results, threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    if base_results:
+        print(f"No regressions beyond {threshold:.0%}")
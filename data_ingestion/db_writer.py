@@ -0,0 +1,169 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from telemetry import count, timer
+
+
+DB_PATH = "raw_racing_data.db"
+
+# how long a connection waits on another writer's lock before "database is locked"
+BUSY_TIMEOUT_MS = 30_000
+
+
+def connect(db_path=DB_PATH, **kwargs) -> sqlite3.Connection:
+    # WAL: readers never block the writer and a commit is one append, not a journal rewrite;
+    # the mode is stored in the db file, so every later connection gets it too
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # WAL keeps the db consistent with NORMAL; a power cut can only lose the last commits
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class DbWriter:
+    """Write-behind loader: one long-lived connection on its own thread.
+
+    Callers queue (sql, rows) and carry on. The writer thread runs them with
+    executemany inside one transaction and commits once `batch_rows` rows are
+    waiting or `flush_every` seconds have passed since the first of them,
+    instead of a connect / commit / close per race. Statements keep the order
+    they were queued in.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_rows=5000, flush_every=2.0, queue_size=10_000):
+        self.db_path = db_path
+        self.batch_rows = batch_rows
+        self.flush_every = flush_every
+        # bounded -> a writer that falls behind slows the scrapers down instead of eating memory
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rows_written = 0
+        self.commits = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self.run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, *statements):
+        """Queue (sql, rows) pairs that must land in the same commit."""
+        unit = [(sql, rows) for sql, rows in ((sql, list(rows)) for sql, rows in statements) if rows]
+        if unit:
+            self.queue.put(unit)
+
+    def executemany(self, sql: str, rows):
+        self.write((sql, rows))
+
+    def execute(self, sql: str, params=()):
+        self.write((sql, [params]))
+
+    def flush(self):
+        """Block until everything queued so far is committed."""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        print(f"DB writer: {self.rows_written} rows in {self.commits} commits, {self.errors} errors")
+
+    def run(self):
+        conn = connect(self.db_path)
+        batch = []
+        batch_rows = 0
+        deadline = None
+
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = "timeout"
+
+            if isinstance(item, list):
+                batch.append(item)
+                batch_rows += sum(len(rows) for _, rows in item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_every
+                if batch_rows < self.batch_rows:
+                    continue
+
+            self.commit(conn, batch)
+            batch = []
+            batch_rows = 0
+            deadline = None
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                break
+
+        conn.close()
+
+    def commit(self, conn, batch):
+        if not batch:
+            return
+
+        try:
+            self.write_units(conn, batch)
+        except sqlite3.Error:
+            # one bad statement rolled back the whole batch; redo it a unit at a
+            # time so only the bad unit is lost
+            for unit in batch:
+                try:
+                    self.write_units(conn, [unit])
+                except sqlite3.Error as e:
+                    self.errors += 1
+                    statement = " ".join(unit[0][0].split()[:4])
+                    error_message = f"DB write failed: {e} ({statement} ...)\n"
+                    print(error_message)
+                    with open("errors.txt", "a") as f:
+                        f.write(error_message)
+
+    def write_units(self, conn, units):
+        with timer("scrape_db_commit_seconds"), conn:
+            for sql, rows in group_runs(units):
+                conn.executemany(sql, rows)
+        rows = sum(len(rows) for unit in units for _, rows in unit)
+        self.rows_written += rows
+        self.commits += 1
+        count("scrape_db_rows_total", rows)
+
+
+def group_runs(units):
+    # merge back-to-back statements with the same sql into one executemany
+    runs = []
+    for sql, rows in (statement for unit in units for statement in unit):
+        if runs and runs[-1][0] == sql:
+            runs[-1][1].extend(rows)
+        else:
+            runs.append((sql, list(rows)))
+    return runs
+
+
+_writer = None
+
+
+def start_writer(**kwargs) -> DbWriter:
+    """Start the shared writer, e.g. start_writer(batch_rows=2000, flush_every=1)."""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+    _writer = DbWriter(**kwargs)
+    return _writer
+
+
+def get_writer() -> DbWriter:
+    global _writer
+    if _writer is None:
+        _writer = DbWriter()
+    return _writer
+
+
+def stop_writer():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
@@ -0,0 +1,108 @@
+import hashlib
+import re
+import unicodedata
+from datetime import date as date_type
+
+
+# one row per horse ever seen; horse_results.horse_id points here
+CREATE_HORSE_IDENTITY = """
+CREATE TABLE IF NOT EXISTS horse_identity (
+    horse_id INTEGER PRIMARY KEY,
+    horse_key TEXT,
+    name TEXT,
+    sire TEXT,
+    dam TEXT,
+    foaled INTEGER
+)
+"""
+
+INSERT_IDENTITY = """
+    INSERT OR IGNORE INTO horse_identity (horse_id, horse_key, name, sire, dam, foaled)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# country of birth the site sometimes appends: "(NZ)", "(IRE)", "(USA)"
+COUNTRY_SUFFIX = re.compile(r"\s*\([a-z]{2,3}\)\s*$")
+
+
+def normalise(text) -> str:
+    # "Pride Of Jenni (NZ)", "pride of jenni", "Pride-of-Jenni" -> "prideofjenni"
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode().lower().strip()
+    return re.sub(r"[^a-z0-9]", "", COUNTRY_SUFFIX.sub("", text))
+
+
+def foaling_season(age, race_date) -> int | None:
+    # horses all age on 1 August, so season start year - age is the same for every run a horse has
+    try:
+        age = int(str(age).strip())
+        race_date = date_type.fromisoformat(str(race_date)[:10])
+    except ValueError:
+        return None
+    return (race_date.year if race_date.month >= 8 else race_date.year - 1) - age
+
+
+def identify(name, sire, dam, age=None, race_date=None):
+    """(horse_id, horse_key, foaled) for one runner, or None without a name.
+
+    The key is the normalised name, sire and dam. Only when both parents are
+    missing is the foaling season (from age and race date) added to tell
+    same-named horses apart. The id is a 53-bit hash of the key: the same on
+    every machine and run, and small enough to survive pandas reading a
+    nullable INTEGER column as float64.
+    """
+    name_key = normalise(name)
+    if not name_key:
+        return None
+
+    sire_key, dam_key = normalise(sire), normalise(dam)
+    foaled = foaling_season(age, race_date)
+    key = f"{name_key}|{sire_key}|{dam_key}"
+    if not sire_key and not dam_key and foaled is not None:
+        key += f"|{foaled}"
+
+    horse_id = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big") >> 11
+    return horse_id, key, foaled
+
+
+def identity_rows(runners) -> tuple[list, list]:
+    """horse_id per runner, and the horse_identity rows for them.
+
+    runners: (name, sire, dam, age, race_date) tuples.
+    """
+    horse_ids, rows = [], []
+    for name, sire, dam, age, race_date in runners:
+        identity = identify(name, sire, dam, age, race_date)
+        if identity is None:
+            horse_ids.append(None)
+            continue
+        horse_id, key, foaled = identity
+        horse_ids.append(horse_id)
+        rows.append((horse_id, key, name, sire, dam, foaled))
+    return horse_ids, rows
+
+
+def backfill(conn, chunk_size=50000):
+    """Fill horse_results.horse_id (and horse_identity) for rows loaded before it existed."""
+    last_rowid, filled = 0, 0
+    while True:
+        chunk = conn.execute("""
+            SELECT horse_results.rowid, horse_results.name, horse_results.sire, horse_results.dam,
+                   horse_results.age, meetings.date_utc
+            FROM horse_results
+            LEFT JOIN meetings ON meetings.meeting_id = horse_results.meeting_id
+            WHERE horse_results.rowid > ? AND horse_results.horse_id IS NULL
+            ORDER BY horse_results.rowid
+            LIMIT ?
+        """, (last_rowid, chunk_size)).fetchall()
+        if not chunk:
+            break
+
+        horse_ids, rows = identity_rows(row[1:] for row in chunk)
+        conn.executemany(INSERT_IDENTITY, rows)
+        conn.executemany("UPDATE horse_results SET horse_id = ? WHERE rowid = ?",
+                         [(horse_id, row[0]) for horse_id, row in zip(horse_ids, chunk) if horse_id is not None])
+        last_rowid = chunk[-1][0]
+        filled += len(chunk)
+    print(f"Backfilled horse_id on {filled} horse_results rows")
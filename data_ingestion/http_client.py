@@ -0,0 +1,181 @@
+import random
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from response_cache import CachedResponse, CacheMiss
+
+
+# (connect, read) seconds -> a hung socket raises instead of stalling the backfill
+DEFAULT_TIMEOUT = (10, 30)
+DEFAULT_POOL_SIZE = 10
+
+
+USER_AGENTS = [
+    # Chrome ‑ Windows
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/137.0.0.0 Safari/537.36",                     
+
+    # Chrome ‑ macOS
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/137.0.0.0 Safari/537.36",                    
+
+    # Chrome ‑ Linux
+    "Mozilla/5.0 (X11; Linux x86_64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/136.0.0.0 Safari/537.36",                     
+
+    # Chrome ‑ Android
+    "Mozilla/5.0 (Linux; Android 10; K) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/126.0.0.0 Mobile Safari/537.36",               
+
+    # Chrome (CriOS) ‑ iPhone
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_3 like Mac OS X) "
+    "AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "CriOS/126.0.0.0 Mobile/15E148 Safari/604.1",           
+
+    # Firefox ‑ Windows
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) "
+    "Gecko/20100101 Firefox/128.0",                        
+
+    # Firefox ‑ Linux
+    "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) "
+    "Gecko/20100101 Firefox/128.0",                         
+
+    # Safari 18 ‑ macOS
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) "
+    "AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "Version/18.0 Safari/605.1.15",                        
+
+    # Edge 126 ‑ Windows (clean)
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/126.0.0.0 Safari/537.36 Edg/126.0.0.0",          
+
+    # Edge 126 ‑ Windows (full string)
+    "mozilla/5.0 (windows nt 10.0; win64; x64) "
+    "applewebkit/537.36 (khtml, like gecko) "
+    "chrome/126.0.0.0 safari/537.36 edg/126.0.0.0 "
+    "gls/100.10.9252.92",                                  
+
+    # Opera 120 ‑ Windows
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/126.0.0.0 Safari/537.36 OPR/120.0.5543.53",     
+
+    # Brave 134 ‑ Windows
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/134.0.0.0 Safari/537.36 Brave/134.0.0.1"        
+]
+
+def get_random_header():
+    return {
+        "User-Agent": random.choice(USER_AGENTS),
+        "Accept": "text/html,application/xhtml+xml,"
+                  "application/xml;q=0.9,image/webp,*/*;q=0.8",
+        "Accept-Language": random.choice([
+            "en-US,en;q=0.9", "en-US;q=0.8"
+        ]),
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+        "Referer": "https://www.racenet.com.au/",
+        "Upgrade-Insecure-Requests": "1",
+        "DNT": "1"
+    }
+
+
+
+class HttpClient:
+    """Keep-alive connection pool per host, shared by both scrapers.
+
+    Requests to the same host reuse open TCP/TLS connections instead of doing a
+    fresh handshake per page. Safe to use from several threads.
+
+    With a `cache` every 200 body is also written to the response cache; with
+    `replay=True` nothing goes over the network and bodies come from the cache.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None, timeout=DEFAULT_TIMEOUT,
+                 cache=None, replay=False):
+        if replay and cache is None:
+            raise ValueError("replay needs a response cache")
+
+        self.pool_size = pool_size
+        self.host_pool_sizes = host_pool_sizes or {}
+        self.timeout = timeout
+        self.cache = cache
+        self.replay = replay
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, host: str) -> requests.Session:
+        with self.lock:
+            if host not in self.sessions:
+                size = self.host_pool_sizes.get(host, self.pool_size)
+                # pool_block -> extra threads wait for a free connection rather than
+                # opening (and throwing away) connections beyond the pool size
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, pool_block=True)
+
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                # don't carry cookies between requests, same as bare requests.get
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                self.sessions[host] = session
+
+            return self.sessions[host]
+
+    def get(self, url, params=None, headers=None, timeout=None) -> requests.Response:
+        if self.replay:
+            body = self.cache.get(url, params)
+            if body is None:
+                raise CacheMiss(url)
+            return CachedResponse(url, body)
+
+        session = self.session(urlsplit(url).netloc)
+        resp = session.get(
+            url,
+            params=params,
+            headers=headers if headers is not None else get_random_header(),
+            timeout=timeout if timeout is not None else self.timeout,
+        )
+
+        if self.cache is not None and resp.status_code == 200:
+            self.cache.put(url, resp.content, params)
+
+        return resp
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+        if self.cache is not None:
+            self.cache.close()
+
+
+_client = None
+
+
+def configure(**kwargs) -> HttpClient:
+    """Replace the shared client, e.g. configure(pool_size=16, timeout=(5, 20))."""
+    global _client
+    if _client is not None:
+        _client.close()
+    _client = HttpClient(**kwargs)
+    return _client
+
+
+def get_client() -> HttpClient:
+    global _client
+    if _client is None:
+        _client = HttpClient()
+    return _client
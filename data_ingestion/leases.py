@@ -0,0 +1,206 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db_writer import DB_PATH, connect
+from scrape_jobs import now_utc
+
+
+CREATE_SCRAPE_LEASES = """
+CREATE TABLE IF NOT EXISTS scrape_leases (
+    scraper TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    status TEXT DEFAULT 'open',
+    owner TEXT,
+    expires_at REAL,
+    claims INTEGER DEFAULT 0,
+    last_error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (scraper, start_date)
+)
+"""
+
+
+class LeaseManager:
+    """Date-range shards of a backfill, handed out to workers through leases.
+
+    A worker claims the earliest shard that is 'open', or 'leased' to someone
+    whose lease has run out, and keeps it by renewing the lease while it works.
+    A worker that crashes stops renewing, so after `lease_seconds` its shard is
+    claimed again by whoever asks next. Claims happen under BEGIN IMMEDIATE, so
+    any number of processes (or machines sharing the db file) can take part.
+    """
+
+    def __init__(self, scraper: str, db_path=DB_PATH, lease_seconds=600, owner=None):
+        self.scraper = scraper
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+
+        # shared with the heartbeat thread
+        self.lock = threading.Lock()
+        self.conn = connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute(CREATE_SCRAPE_LEASES)
+
+    def plan(self, start_date: str, end_date: str, shard_days: int) -> int:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+
+        shards = []
+        while start <= end:
+            shard_end = min(start + timedelta(shard_days - 1), end)
+            shards.append((self.scraper, f"{start:%Y-%m-%d}", f"{shard_end:%Y-%m-%d}", now_utc()))
+            start = shard_end + timedelta(1)
+
+        # shards planned by an earlier run (or another worker) are left as they are
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            before = self.conn.total_changes
+            self.conn.executemany("""
+                INSERT OR IGNORE INTO scrape_leases (scraper, start_date, end_date, updated_at)
+                VALUES (?, ?, ?, ?)
+            """, shards)
+            planned = self.conn.total_changes - before
+            # a new run gets another `max_claims` tries at shards an earlier one handed back unfinished
+            self.conn.execute("UPDATE scrape_leases SET claims = 0 WHERE scraper = ? AND status = 'open'",
+                              (self.scraper,))
+            self.conn.execute("COMMIT")
+            return planned
+
+    def claim(self, max_claims=3):
+        """Lease the next free shard as (start_date, end_date), or None when none is left."""
+        now = time.time()
+        with self.lock:
+            # take the write lock up front, so two workers can't both pick the same shard
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("""
+                    SELECT start_date, end_date FROM scrape_leases
+                    WHERE scraper = ?
+                      AND (status = 'open' OR (status = 'leased' AND expires_at < ?))
+                      AND claims < ?
+                    ORDER BY start_date
+                    LIMIT 1
+                """, (self.scraper, now, max_claims)).fetchone()
+
+                if row is not None:
+                    self.conn.execute("""
+                        UPDATE scrape_leases
+                        SET status = 'leased', owner = ?, expires_at = ?, claims = claims + 1, updated_at = ?
+                        WHERE scraper = ? AND start_date = ?
+                    """, (self.owner, now + self.lease_seconds, now_utc(), self.scraper, row[0]))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        return row
+
+    def update(self, sql: str, params: tuple) -> bool:
+        # only ever touches a shard this worker still holds
+        with self.lock:
+            cursor = self.conn.execute(sql + " AND owner = ? AND status = 'leased'", params + (self.owner,))
+        return cursor.rowcount > 0
+
+    def renew(self, start_date: str) -> bool:
+        return self.update("""
+            UPDATE scrape_leases SET expires_at = ?, updated_at = ?
+            WHERE scraper = ? AND start_date = ?
+        """, (time.time() + self.lease_seconds, now_utc(), self.scraper, start_date))
+
+    def complete(self, start_date: str) -> bool:
+        return self.update("""
+            UPDATE scrape_leases SET status = 'done', expires_at = NULL, last_error = NULL, updated_at = ?
+            WHERE scraper = ? AND start_date = ?
+        """, (now_utc(), self.scraper, start_date))
+
+    def release(self, start_date: str, error) -> bool:
+        # hand the shard straight back instead of waiting for the lease to expire
+        return self.update("""
+            UPDATE scrape_leases SET status = 'open', expires_at = NULL, last_error = ?, updated_at = ?
+            WHERE scraper = ? AND start_date = ?
+        """, (str(error), now_utc(), self.scraper, start_date))
+
+    def keep_alive(self, start_date: str) -> threading.Event:
+        """Renew the lease in the background until the returned event is set."""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(start_date):
+                    print(f"[{self.owner}] lost the lease on {self.scraper} {start_date}")
+                    return
+
+        threading.Thread(target=heartbeat, name="lease-heartbeat", daemon=True).start()
+        return stop
+
+    def summary(self) -> dict:
+        with self.lock:
+            return dict(self.conn.execute("""
+                SELECT status, count(*) FROM scrape_leases WHERE scraper = ? GROUP BY status
+            """, (self.scraper,)).fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def run_worker(scraper: str, run_shard, db_path=DB_PATH, lease_seconds=600, max_claims=3):
+    # claim -> run -> complete until no shard is left. run_shard returns how much of the shard it
+    # left unfinished (None / 0: nothing); such a shard goes back in the pool instead of being done
+    leases = LeaseManager(scraper, db_path, lease_seconds)
+
+    while (shard := leases.claim(max_claims)) is not None:
+        start_date, end_date = shard
+        print(f"[{leases.owner}] claimed {scraper} {start_date}..{end_date}")
+
+        stop = leases.keep_alive(start_date)
+        try:
+            unfinished = run_shard(start_date, end_date)
+        except Exception as e:
+            print(f"[{leases.owner}] {scraper} {start_date}..{end_date} failed: {e}")
+            leases.release(start_date, e)
+        else:
+            if unfinished:
+                print(f"[{leases.owner}] {scraper} {start_date}..{end_date}: {unfinished} unfinished, handing it back")
+                leases.release(start_date, f"{unfinished} unfinished")
+            else:
+                leases.complete(start_date)
+        finally:
+            stop.set()
+
+    leases.close()
+
+
+def run_sharded(scraper: str, run_shard, start_date: str, end_date: str, shard_days=7, workers=1,
+                lease_seconds=600, max_claims=3, db_path=DB_PATH):
+    """Split [start_date, end_date] into shards and work through them with
+    `workers` processes, each calling run_shard(start_date, end_date).
+
+    A shard is done once run_shard returns nothing left unfinished; otherwise
+    it is claimed again, up to `max_claims` times per run.
+
+    Running this on several machines against the same db file shares the
+    shards between all of them.
+    """
+    leases = LeaseManager(scraper, db_path, lease_seconds)
+    planned = leases.plan(start_date, end_date, shard_days)
+    print(f"Planned {planned} new {shard_days}-day shards between {start_date} and {end_date}")
+    # no sqlite connection open across the fork
+    leases.close()
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(scraper, run_shard, db_path, lease_seconds, max_claims))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    leases = LeaseManager(scraper, db_path, lease_seconds)
+    print(f"Shards: {leases.summary()}")
+    leases.close()
@@ -0,0 +1,256 @@
+import argparse
+
+import horse_identity
+from db_writer import DB_PATH, connect
+from leases import CREATE_SCRAPE_LEASES
+from scrape_jobs import CREATE_SCRAPE_JOBS
+from telemetry import CREATE_SCRAPE_METRICS
+
+
+CREATE_MEETINGS = """
+CREATE TABLE IF NOT EXISTS meetings (
+    meeting_id TEXT PRIMARY KEY,
+    name TEXT,
+    slug TEXT,
+    date_utc TEXT,
+    time_group TEXT,
+    address TEXT,
+    state TEXT,
+    country TEXT,
+    rail_position TEXT,
+    track_comments TEXT,
+    penetrometer REAL,
+    weather_last_updated TEXT,
+    meeting_type TEXT,
+    meeting_category TEXT,
+    meeting_total_prize REAL
+)
+"""
+
+CREATE_RACES = """
+CREATE TABLE IF NOT EXISTS races (
+    race_id TEXT PRIMARY KEY,
+    meeting_id TEXT,
+    slug TEXT,
+    event_number TEXT,
+    name TEXT,
+    distance INTEGER,
+    event_class TEXT,
+    group_type TEXT,
+    track_type TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    track_condition_overall TEXT,
+    track_condition_rating TEXT,
+    track_condition_surface TEXT,
+    is_abandoned BOOLEAN,
+    place_winners INTEGER,
+    FOREIGN KEY (meeting_id) REFERENCES meetings (meeting_id)
+)
+"""
+
+CREATE_RACE_DETAILS = """
+CREATE TABLE IF NOT EXISTS race_details (
+    race_id TEXT PRIMARY KEY,
+    total_prize TEXT,
+    first_prize TEXT,
+    second_prize TEXT,
+    third_prize TEXT,
+    winning_time TEXT,
+    sectional_time TEXT,
+    track_rail_info TEXT,
+    FOREIGN KEY (race_id) REFERENCES races (race_id)
+)
+"""
+
+CREATE_HORSE_RESULTS = """
+CREATE TABLE IF NOT EXISTS horse_results (
+    meeting_id TEXT,
+    race_id TEXT,
+    finish_position TEXT,
+    running_number TEXT,
+    name TEXT,
+    barrier TEXT,
+    age TEXT,
+    sex TEXT,
+    trainer TEXT,
+    jockey TEXT,
+    weight TEXT,
+    sire TEXT,
+    dam TEXT,
+    position_400m TEXT,
+    position_800m TEXT,
+    margin TEXT,
+    sp TEXT,
+    flucs TEXT,
+    sire_all TEXT,
+    sire_dry TEXT,
+    sire_wet TEXT,
+    sire_starts TEXT,
+    form_letters TEXT,
+    rating TEXT,
+    last_race TEXT,
+    best_win TEXT,
+    career TEXT,
+    last_10 TEXT,
+    prize TEXT,
+    avg_earn TEXT,
+    last_win TEXT,
+    win_percent TEXT,
+    place_percent TEXT,
+    tj_win_percent TEXT,
+    jh TEXT,
+    twelve_month TEXT,
+    season TEXT,
+    track TEXT,
+    distance TEXT,
+    track_dist TEXT,
+    firm TEXT,
+    good TEXT,
+    soft TEXT,
+    heavy TEXT,
+    wet TEXT,
+    first_up TEXT,
+    second_up TEXT,
+    third_up TEXT,
+    class TEXT,
+    group1 TEXT,
+    group2 TEXT,
+    group3 TEXT,
+    listed TEXT,
+    clockwise TEXT,
+    a_clockwise TEXT,
+    night TEXT,
+    synthetic TEXT,
+    as_fav TEXT,
+    roi TEXT,
+    PRIMARY KEY (race_id, running_number),
+    FOREIGN KEY (meeting_id) REFERENCES meetings (meeting_id),
+    FOREIGN KEY (race_id) REFERENCES races (race_id)
+)
+"""
+
+
+def change_log_trigger(table: str, key: str, event: str) -> str:
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS log_{table}_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO raw_changes (table_name, key) VALUES ('{table}', NEW.{key});
+        END
+    """
+
+
+# Each migration is (description, statements) and runs once, in order, in its own
+# transaction; PRAGMA user_version records how many have been applied. Never edit
+# one that has shipped - append a new one instead. A statement is SQL, or a
+# function run on the connection inside the migration's transaction.
+MIGRATIONS = [
+    ("raw tables", [
+        CREATE_MEETINGS,
+        CREATE_RACES,
+        CREATE_RACE_DETAILS,
+        CREATE_HORSE_RESULTS,
+    ]),
+    ("scrape_jobs", [CREATE_SCRAPE_JOBS]),
+    ("scrape_leases", [CREATE_SCRAPE_LEASES]),
+    ("indexes for the scraper and transform lookups", [
+        # per-day meeting lookups (JobQueue.plan) answered from the index alone
+        "CREATE INDEX IF NOT EXISTS idx_meetings_date ON meetings (date_utc, meeting_id, slug)",
+        # races of a meeting, covering the slug join
+        "CREATE INDEX IF NOT EXISTS idx_races_meeting ON races (meeting_id, race_id, slug)",
+        # unindexed foreign key; race_id is already the lead of the primary key
+        "CREATE INDEX IF NOT EXISTS idx_horse_results_meeting ON horse_results (meeting_id)",
+        # JobQueue.pending / summary range scans
+        "CREATE INDEX IF NOT EXISTS idx_scrape_jobs_date ON scrape_jobs (date_utc, race_id)",
+    ]),
+    ("raw_changes log for incremental transforms", [
+        # every insert / replace / update of a raw row logs its key under an ever-increasing seq
+        # (AUTOINCREMENT never hands a seq out twice, unlike rowids after a REPLACE)
+        """
+        CREATE TABLE IF NOT EXISTS raw_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT,
+            key TEXT
+        )
+        """,
+        *(
+            change_log_trigger(table, key, event)
+            for table, key in [("meetings", "meeting_id"), ("races", "race_id"),
+                               ("race_details", "race_id"), ("horse_results", "race_id")]
+            for event in ["INSERT", "UPDATE"]
+        ),
+    ]),
+    ("horse identity index", [
+        horse_identity.CREATE_HORSE_IDENTITY,
+        "ALTER TABLE horse_results ADD COLUMN horse_id INTEGER",
+        # a horse's history is an integer index lookup instead of a name scan
+        "CREATE INDEX IF NOT EXISTS idx_horse_results_horse ON horse_results (horse_id)",
+        # horse_id is derived, not scraped: filling it in mustn't log every row as changed
+        "DROP TRIGGER IF EXISTS log_horse_results_update",
+        horse_identity.backfill,
+        change_log_trigger("horse_results", "race_id", "UPDATE"),
+    ]),
+    ("scrape metrics", [
+        CREATE_SCRAPE_METRICS,
+        "CREATE INDEX IF NOT EXISTS idx_scrape_metrics_run ON scrape_metrics (run_id, metric)",
+    ]),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path=DB_PATH, target=None) -> int:
+    """Bring db_path up to `target` (default: the latest) version, in place.
+
+    Works on an empty file and on a database built by the old create_db.py,
+    whose tables the first migration adopts as they are. Returns the version.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    conn = connect(db_path, isolation_level=None)
+    applied = 0
+
+    while schema_version(conn) < target:
+        # re-read the version under the write lock; another process may have got here first
+        conn.execute("BEGIN IMMEDIATE")
+        version = schema_version(conn)
+        if version >= target:
+            conn.execute("ROLLBACK")
+            break
+
+        description, statements = MIGRATIONS[version]
+        print(f"Migrating {db_path} to version {version + 1}: {description}")
+        try:
+            for sql in statements:
+                sql(conn) if callable(sql) else conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        applied += 1
+
+    if applied:
+        # planner statistics for the new indexes; analysis_limit samples each index
+        # instead of reading all of it, so this stays quick on a multi-GB db
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+
+    version = schema_version(conn)
+    conn.close()
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or upgrade raw_racing_data.db")
+    parser.add_argument("--db", default=DB_PATH, help="database file")
+    parser.add_argument("--status", action="store_true", help="only print the current version")
+    args = parser.parse_args()
+
+    if args.status:
+        conn = connect(args.db)
+        print(f"{args.db}: version {schema_version(conn)} of {len(MIGRATIONS)}")
+        conn.close()
+    else:
+        print(f"{args.db}: version {migrate(args.db)}")
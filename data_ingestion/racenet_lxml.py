@@ -0,0 +1,342 @@
+"""lxml backend for the racenet page parsers in scraper-race.py.
+
+Same four process_* functions and the same output dicts, but run on an lxml
+tree built straight from the response bytes, with every selector compiled to
+XPath once at import instead of re-parsing a CSS selector per runner.
+"""
+from bs4.dammit import EncodingDetector
+from lxml import etree
+
+
+# one parser per encoding, built on first use
+PARSERS = {}
+
+# BeautifulSoup's get_text() leaves out comments and script/style/template text
+SKIP_TEXT = {"script", "style", "template"}
+
+
+def has_class(name: str) -> str:
+    # CSS `.name` as an XPath predicate
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def first(expr: str) -> etree.XPath:
+    # select_one(): first match in document order
+    return etree.XPath(f"({expr})[1]")
+
+
+# race details
+DETAIL_ROWS = etree.XPath(f"//*[{has_class('event-header__expand-column-row')}]")
+DETAIL_HEADER = first(f".//*[{has_class('header')}]")
+
+# results
+RESULT_ROWS = etree.XPath(f"//*[{has_class('selection-result')}]")
+RESULT_NAME = first(f".//a[ancestor::*[{has_class('selection-result__info-competitor-name')}]]")
+RESULT_PLACE = first(f".//*[{has_class('selection-result__competitor-place')}]")
+RESULT_BARRIER = first(f".//*[{has_class('selection-result__info-barrier')}]")
+RESULT_AGE = first(f".//*[{has_class('selection-result__info-age')}]")
+RESULT_SEX = first(f".//*[{has_class('selection-result__info-sex')}]")
+RESULT_TRAINER = first(f".//*[{has_class('selection-result__info-trainer')}]")
+RESULT_JOCKEY = first(f".//*[{has_class('selection-result__info-jockey')}]")
+RESULT_WEIGHT = first(f".//*[{has_class('selection-result__info-weight')}]")
+RESULT_SIRE = first(f".//*[{has_class('selection-result__info-sire')}]")
+MARGIN_COLUMNS = etree.XPath(
+    f".//*[{has_class('selection-result__table-column')}]"
+    f"[ancestor::*[{has_class('selection-result__table')} and {has_class('margin')}]]"
+)
+ODDS_COLUMNS = etree.XPath(
+    f".//*[{has_class('selection-result__table-column')}]"
+    f"[ancestor::*[{has_class('selection-result__table')} and {has_class('odds')}]]"
+)
+COLUMN_HEADER = first(f".//*[{has_class('selection-result__table-column-header')}]")
+COLUMN_DETAILS = etree.XPath(f".//*[{has_class('selection-result__table-column-details')}]")
+COLUMN_DETAIL = first(f".//*[{has_class('selection-result__table-column-details')}]")
+
+# overview
+OVERVIEW_ROWS = etree.XPath(f"//*[{has_class('event-selection-row-container')}]")
+OVERVIEW_NAME = first(f".//*[{has_class('horseracing-selection-details-name')}]")
+OVERVIEW_FORM = first(f".//*[{has_class('form-letters')}]")
+OVERVIEW_RATING = first(f".//*[{has_class('event-selection-row-right__column--rating')}]")
+OVERVIEW_LAST_RACE = first(f".//*[{has_class('event-selection-row-right__column--lastRace')}]")
+OVERVIEW_BEST_WIN = first(f".//*[{has_class('odds-link__odds')}]")
+
+# full form
+FORM_BLOCKS = etree.XPath(f"//*[{has_class('form-guide-full-form__selection')}]")
+FORM_SCRATCHED = first(f".//*[{has_class('selection-details--scratched')}]")
+FORM_INFO = first(f".//*[{has_class('racing-full-form-text')}]")
+FORM_SPANS = etree.XPath(".//span")
+FORM_STRONG = first(".//strong")
+FORM_NAME = first(f".//strong[ancestor::*[{has_class('selection-details__name')}]]")
+FORM_BOXES = etree.XPath(f".//*[{has_class('form-grid-box')}]")
+FORM_BOX_HEADER = first(f".//*[{has_class('form-grid-box__header')}]")
+FORM_BOX_DETAILS = first(f".//*[{has_class('form-grid-box__details')}]")
+
+
+def parse_page(body: bytes):
+    # same encoding choice as BeautifulSoup(body, "lxml"): the first candidate
+    # (BOM, then <meta charset>, then a guess) that lxml knows is used
+    parser = None
+    for encoding in EncodingDetector(body, is_html=True).encodings:
+        if encoding not in PARSERS:
+            try:
+                PARSERS[encoding] = etree.HTMLParser(encoding=encoding)
+            except LookupError:
+                continue
+        parser = PARSERS[encoding]
+        break
+
+    root = etree.fromstring(body, parser or etree.HTMLParser())
+
+    # an empty body parses to nothing; bs4 gives an empty soup
+    return root if root is not None else etree.Element("html")
+
+
+def iter_text(el):
+    if el.text and el.tag not in SKIP_TEXT:
+        yield el.text
+    for child in el:
+        # comments / processing instructions have a non-string tag
+        if isinstance(child.tag, str) and child.tag not in SKIP_TEXT:
+            yield from iter_text(child)
+        if child.tail:
+            yield child.tail
+
+
+def text(el, separator="") -> str:
+    # get_text(separator, strip=True)
+    return separator.join(s for s in (s.strip() for s in iter_text(el)) if s)
+
+
+def direct_strings(el) -> list[str]:
+    # find_all(string=True, recursive=False), which also returns comment text
+    strings = [el.text] if el.text else []
+    for child in el:
+        if not isinstance(child.tag, str) and child.text:
+            strings.append(child.text)
+        if child.tail:
+            strings.append(child.tail)
+    return strings
+
+
+def next_tag(el):
+    # find_next_sibling()
+    for sibling in el.itersiblings():
+        if isinstance(sibling.tag, str):
+            return sibling
+    return None
+
+
+def one(xpath, el):
+    found = xpath(el)
+    return found[0] if found else None
+
+
+def process_race_details(root) -> dict:
+    fields = [
+        "Prize",
+        "1st",
+        "2nd",
+        "3rd",
+        "Time",
+        "Sectional Time",
+        "Track Info",
+    ]
+    info = {key: None for key in fields}
+
+    for row in DETAIL_ROWS(root):
+        label_tag = one(DETAIL_HEADER, row)
+        if label_tag is None:
+            continue
+
+        label = text(label_tag).rstrip(":")
+        if label not in info:
+            continue
+
+        value = ''.join(direct_strings(row)).strip()
+
+        if not value:
+            value_tag = next_tag(label_tag)
+            if value_tag is not None:
+                value = text(value_tag)
+
+        info[label] = value if value else ""
+
+    return info
+
+
+def process_results(root) -> list[dict]:
+    results = []
+
+    for horse in RESULT_ROWS(root):
+        name_tag = one(RESULT_NAME, horse)
+        name_text = text(name_tag) if name_tag is not None else ""
+
+        if '.' in name_text:
+            running_number, name = name_text.split('.', 1)
+            running_number = running_number.strip()
+            name = name.strip()
+        else:
+            running_number = ""
+            name = name_text
+
+        position_tag = one(RESULT_PLACE, horse)
+        position = text(position_tag) if position_tag is not None else ""
+
+        barrier_tag = one(RESULT_BARRIER, horse)
+        barrier = text(barrier_tag).strip('()') if barrier_tag is not None else ""
+
+        age_tag = one(RESULT_AGE, horse)
+        age = text(age_tag) if age_tag is not None else ""
+
+        sex_tag = one(RESULT_SEX, horse)
+        sex = text(sex_tag).strip('()') if sex_tag is not None else ""
+
+        trainer_tag = one(RESULT_TRAINER, horse)
+        trainer = text(trainer_tag).replace("T:", "").strip() if trainer_tag is not None else ""
+
+        jockey_tag = one(RESULT_JOCKEY, horse)
+        jockey = text(jockey_tag).replace("J:", "").strip() if jockey_tag is not None else ""
+
+        weight_tag = one(RESULT_WEIGHT, horse)
+        weight = text(weight_tag) if weight_tag is not None else ""
+
+        sire_tag = one(RESULT_SIRE, horse)
+        if sire_tag is not None:
+            sire_text = text(sire_tag)
+            if ' x ' in sire_text:
+                sire, dam = sire_text.split(' x ', 1)
+            else:
+                sire = sire_text
+                dam = ""
+        else:
+            sire = dam = ""
+
+        pos_400 = pos_800 = margin = ""
+        for col in MARGIN_COLUMNS(horse):
+            header = one(COLUMN_HEADER, col)
+            if header is None: continue
+
+            header_text = text(header)
+            details = one(COLUMN_DETAIL, col)
+            if details is None: continue
+
+            if "400" in header_text:
+                pos_400 = text(details)
+            elif "800" in header_text:
+                pos_800 = text(details)
+            elif "Margin" in header_text:
+                margin = text(details)
+
+        sp = ""
+        for col in ODDS_COLUMNS(horse):
+            header = one(COLUMN_HEADER, col)
+            if header is not None and text(header) == "SP":
+                details = COLUMN_DETAILS(col)
+                if details:
+                    sp = text(details[0])  # first value is Win SP
+
+        results.append({
+            "Position": position,
+            "RunningNumber": running_number,
+            "Name": name,
+            "Barrier": barrier,
+            "Age": age,
+            "Sex": sex,
+            "Trainer": trainer,
+            "Jockey": jockey,
+            "Weight": weight,
+            "Sire": sire,
+            "Dam": dam,
+            "400m": pos_400,
+            "800m": pos_800,
+            "Margin": margin,
+            "SP": sp
+        })
+
+    return results
+
+
+def process_overview(root) -> list[dict]:
+    results = []
+
+    for container in OVERVIEW_ROWS(root):
+        # Skip scratched horses
+        if 'selection-scratched' in (container.get('class') or "").split():
+            continue
+
+        name_tag = one(OVERVIEW_NAME, container)
+        name_text = text(name_tag) if name_tag is not None else ""
+        if '.' in name_text:
+            name = name_text.split('.', 1)[1].strip()
+        else:
+            name = name_text
+
+        form_tag = one(OVERVIEW_FORM, container)
+        rating_tag = one(OVERVIEW_RATING, container)
+        last_race_tag = one(OVERVIEW_LAST_RACE, container)
+        best_win_tag = one(OVERVIEW_BEST_WIN, container)
+
+        results.append({
+            'Name': name,
+            'FormLetters': text(form_tag) if form_tag is not None else "",
+            'Rating': text(rating_tag) if rating_tag is not None else "",
+            'LastRace': text(last_race_tag) if last_race_tag is not None else "",
+            'BestWin': text(best_win_tag) if best_win_tag is not None else ""
+        })
+
+    return results
+
+
+def process_form(root) -> list[dict]:
+    """Scrape the career/track stats table for every horse."""
+    results = []
+    target_labels = [
+        "Career", "Last 10", "Prize", "Avg Earn", "Last Win",
+        "Win %", "Place %", "T/J Win %", "J/H",
+        "12 Month", "Season", "Track", "Distance", "Track/Dist",
+        "Firm", "Good", "Soft", "Heavy", "Wet",
+        "1st Up", "2nd Up", "3rd Up", "Class",
+        "Group 1", "Group 2", "Group 3", "Listed",
+        "Clockwise", "A-Clockwise", "Night", "Synthetic",
+        "As Fav", "ROI $",
+    ]
+    # shared across runners, exactly like the bs4 version
+    extras = {"Flucs": "", "All": "", "Dry": "", "Wet": "", "Starts": "",}
+
+    for block in FORM_BLOCKS(root):
+        if one(FORM_SCRATCHED, block) is not None:
+            continue
+
+        info = one(FORM_INFO, block)
+        if info is not None:
+            for span in FORM_SPANS(info):
+                strong = one(FORM_STRONG, span)
+                if strong is None:
+                    continue
+                label = text(strong).rstrip(":")
+                span_text = text(span, " ")
+
+                if label in ("All", "Dry", "Wet", "Starts"):
+                    extras[label] = span_text.split(":", 1)[1].strip() if ":" in span_text else ""
+                elif label.lower().startswith("flucs"):
+                    extras["Flucs"] = span_text.split(":", 1)[1].strip() if ":" in span_text else ""
+
+        name_tag = one(FORM_NAME, block)
+        raw_name = text(name_tag) if name_tag is not None else ""
+        name = raw_name.split(".", 1)[1].strip() if "." in raw_name else raw_name
+
+        stats = {}
+        for box in FORM_BOXES(block):
+            header = one(FORM_BOX_HEADER, box)
+            detail = one(FORM_BOX_DETAILS, box)
+            if header is not None and detail is not None:
+                stats[text(header)] = text(detail)
+
+        row = {"Name": name}
+        for label in target_labels:
+            row[label] = stats.get(label, "")
+
+        row.update(extras)
+        results.append(row)
+
+    return results
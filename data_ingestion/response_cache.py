@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from db_writer import connect
+
+
+class CacheMiss(KeyError):
+    """Replay asked for a url that was never fetched."""
+
+
+def variables_key(params) -> str:
+    # canonical form of the query params, so the same request always maps to the same key
+    if not params:
+        return ""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+class ResponseCache:
+    """Compressed, content-addressed store of every fetched body.
+
+    Bodies are gzipped under objects/<2 hex>/<sha256>.gz, named by the sha256 of
+    the raw body, so a page fetched twice is only stored once. index.db records
+    every fetch as (url, variables, fetched_at) -> sha256; lookups return the
+    latest fetch.
+    """
+
+    def __init__(self, root="raw_cache"):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+        self.lock = threading.Lock()
+        # WAL + busy timeout: several scraper processes can share one cache
+        self.conn = connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT,
+                variables TEXT,
+                fetched_at TEXT,
+                sha256 TEXT,
+                size INTEGER,
+                PRIMARY KEY (url, variables, fetched_at)
+            )
+        """)
+        self.conn.commit()
+
+    def object_path(self, sha: str) -> str:
+        return os.path.join(self.root, "objects", sha[:2], f"{sha}.gz")
+
+    def put(self, url: str, body: bytes, params=None) -> str:
+        sha = hashlib.sha256(body).hexdigest()
+        path = self.object_path(sha)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so a crash never leaves a truncated object behind
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(body)
+            os.replace(tmp, path)
+
+        fetched_at = datetime.now(timezone.utc).isoformat(timespec="microseconds")
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (url, variables_key(params), fetched_at, sha, len(body)),
+            )
+            self.conn.commit()
+
+        return sha
+
+    def get(self, url: str, params=None):
+        with self.lock:
+            row = self.conn.execute("""
+                SELECT sha256 FROM responses
+                WHERE url = ? AND variables = ?
+                ORDER BY fetched_at DESC
+                LIMIT 1
+            """, (url, variables_key(params))).fetchone()
+
+        if row is None:
+            return None
+
+        with gzip.open(self.object_path(row[0]), "rb") as f:
+            return f.read()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CachedResponse:
+    """The parts of requests.Response the scrapers use, served from the cache."""
+
+    status_code = 200
+
+    def __init__(self, url: str, content: bytes):
+        self.url = url
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
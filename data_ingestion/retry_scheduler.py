@@ -0,0 +1,79 @@
+import heapq
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+
+def racenet_backoff(attempt: int) -> float:
+    # 2 minutes * attempt number + random jitter [2, 4, 6, 8, 10]
+    return (120 * attempt) + random.uniform(0, 30)
+
+
+class RetryLater(Exception):
+    """The work was parked in the retry queue; try it again in `delay` seconds."""
+
+    def __init__(self, delay: float):
+        super().__init__(f"retry in {delay:.0f}s")
+        self.delay = delay
+
+
+class RetryScheduler:
+    """Time-ordered queue of failed fetches waiting for another go.
+
+    A failed url gets its own attempt count and backoff here instead of the
+    scraper sleeping through it, so other races keep going in the meantime.
+    `pop_due()` hands parked work back once its time has come. A url that has
+    failed `max_attempts` times is given up on, as fetch_body used to.
+    """
+
+    def __init__(self, max_attempts=5, backoff=racenet_backoff, clock=time.monotonic):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.clock = clock
+        self.heap = []
+        self.order = itertools.count()  # keeps equal times first-in first-out
+        self.attempts = {}              # url -> failed attempts so far
+        self.given_up = {}              # url -> last error
+        self.retries = 0
+
+    def attempt(self, key) -> int:
+        # number of the attempt about to be made, from 1
+        return self.attempts.get(key, 0) + 1
+
+    def failed(self, key, error, retryable=True):
+        """Record a failed attempt; the seconds until the next one, or None to give up."""
+        attempts = self.attempts.get(key, 0) + 1
+        self.attempts[key] = attempts
+
+        if not retryable or attempts >= self.max_attempts:
+            self.given_up[key] = error
+            self.attempts.pop(key)
+            print(f"Giving up on {key} after {attempts}/{self.max_attempts} attempts: {error}")
+            return None
+
+        delay = self.backoff(attempts)
+        retry_at = datetime.now() + timedelta(seconds=delay)
+        print(f"Error on {key}: {error} → attempt {attempts + 1}/{self.max_attempts} at {retry_at:%H:%M:%S}")
+        return delay
+
+    def succeeded(self, key):
+        self.attempts.pop(key, None)
+
+    def defer(self, work, delay: float):
+        self.retries += 1
+        heapq.heappush(self.heap, (self.clock() + delay, next(self.order), work))
+
+    def pop_due(self):
+        if self.heap and self.heap[0][0] <= self.clock():
+            return heapq.heappop(self.heap)[2]
+        return None
+
+    def wait_time(self):
+        # seconds until the next parked item is due, None when nothing is parked
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - self.clock(), 0)
+
+    def summary(self) -> str:
+        return f"retries: {self.retries} scheduled, {len(self.heap)} waiting, {len(self.given_up)} given up"
@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+
+from db_writer import DB_PATH, connect
+
+
+# one job per page of a race, in the order scraper-race fetches them
+PAGES = ("results", "overview", "form")
+
+CREATE_SCRAPE_JOBS = """
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+    race_id TEXT,
+    page TEXT,
+    meeting_id TEXT,
+    date_utc TEXT,
+    slug TEXT,
+    status TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (race_id, page),
+    FOREIGN KEY (race_id) REFERENCES races (race_id)
+)
+"""
+
+
+def now_utc() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class JobQueue:
+    """Persistent (race_id, page) fetch jobs in raw_racing_data.db.
+
+    Each job is 'pending', 'retrying', 'done' or 'failed'. A race is finished
+    once all of its pages are done and its race_details row is loaded, so a
+    restarted run picks up exactly the races that are not.
+
+    With a `writer` (db_writer.DbWriter) the per-page status updates are queued
+    on it and committed in its batches, in order with the rows they belong to.
+    """
+
+    def __init__(self, db_path=DB_PATH, writer=None):
+        self.conn = connect(db_path)
+        self.writer = writer
+        self.conn.execute(CREATE_SCRAPE_JOBS)
+        self.conn.commit()
+
+    def update(self, sql: str, params: tuple):
+        if self.writer is not None:
+            self.writer.execute(sql, params)
+        else:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def plan(self, start_date: str, end_date: str) -> int:
+        # one range query for the whole backfill; races already in horse_results start as done
+        cursor = self.conn.execute(f"""
+            INSERT OR IGNORE INTO scrape_jobs (race_id, page, meeting_id, date_utc, slug, status, updated_at)
+            SELECT
+                races.race_id,
+                pages.page,
+                meetings.meeting_id,
+                meetings.date_utc,
+                meetings.slug || '/' || races.slug,
+                CASE WHEN EXISTS (SELECT 1 FROM horse_results WHERE horse_results.race_id = races.race_id)
+                     THEN 'done' ELSE 'pending' END,
+                ?
+            FROM races
+            JOIN meetings ON races.meeting_id = meetings.meeting_id
+            CROSS JOIN ({" UNION ALL ".join(f"SELECT '{page}' AS page" for page in PAGES)}) AS pages
+            WHERE meetings.date_utc BETWEEN ? AND ?
+        """, (now_utc(), start_date, end_date))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def pending(self, start_date: str, end_date: str, max_attempts: int = 3, everything=False) -> list[tuple]:
+        """Unfinished races as (meeting_id, race_id, date, slug, done_pages).
+
+        `everything=True` returns every planned race in the range instead.
+        """
+        rows = self.conn.execute("""
+            SELECT
+                meeting_id, race_id, date_utc, slug,
+                group_concat(CASE WHEN status = 'done' THEN page END)
+            FROM scrape_jobs
+            WHERE date_utc BETWEEN ? AND ?
+            GROUP BY race_id
+            HAVING ? OR ((sum(status != 'done') > 0
+                          OR NOT EXISTS (SELECT 1 FROM race_details WHERE race_details.race_id = scrape_jobs.race_id))
+                         AND max(attempts) < ?)
+            ORDER BY date_utc, race_id
+        """, (start_date, end_date, everything, max_attempts)).fetchall()
+
+        return [
+            (meeting_id, race_id, date, slug, set(done.split(",")) if done else set())
+            for meeting_id, race_id, date, slug, done in rows
+        ]
+
+    def mark_done(self, race_id: str, page: str):
+        self.update("""
+            UPDATE scrape_jobs SET status = 'done', last_error = NULL, updated_at = ?
+            WHERE race_id = ? AND page = ?
+        """, (now_utc(), race_id, page))
+
+    def mark_failed(self, race_id: str, page: str, error):
+        self.update("""
+            UPDATE scrape_jobs SET status = 'failed', attempts = attempts + 1, last_error = ?, updated_at = ?
+            WHERE race_id = ? AND page = ?
+        """, (str(error), now_utc(), race_id, page))
+
+    def mark_retrying(self, race_id: str, page: str, note: str):
+        # still unfinished; a run that stops here picks the page up again on restart
+        self.update("""
+            UPDATE scrape_jobs SET status = 'retrying', last_error = ?, updated_at = ?
+            WHERE race_id = ? AND page = ?
+        """, (note, now_utc(), race_id, page))
+
+    def summary(self, start_date: str, end_date: str) -> dict:
+        if self.writer is not None:
+            self.writer.flush()
+        return dict(self.conn.execute("""
+            SELECT status, count(*) FROM scrape_jobs
+            WHERE date_utc BETWEEN ? AND ?
+            GROUP BY status
+        """, (start_date, end_date)).fetchall())
+
+    def close(self):
+        self.conn.close()
@@ -1,8 +1,16 @@
-import requests, json
-import sqlite3
+import json
 import time
 import random
+import argparse
 from datetime import datetime, timedelta
+from functools import partial
+
+from db_writer import get_writer, start_writer, stop_writer
+from http_client import configure, get_client
+from leases import run_sharded
+from migrations import migrate
+from response_cache import ResponseCache
+from telemetry import count, start_telemetry, stop_telemetry, timer
 
 
 BASE = "https://puntapi.com/graphql-horse-racing"
@@ -24,11 +32,11 @@ HEADERS = {
 }
 
 
-def fetch_params(date: str):
+def fetch_params(start_date: str, end_date: str = None, limit: int = 100):
     variables = {
-        "startDate": date,
-        "endDate": date,
-        "limit": 100,
+        "startDate": start_date,
+        "endDate": end_date or start_date,
+        "limit": limit,
     }
     params = {
         "operationName": "meetingsIndexByStartEndDate",
@@ -131,7 +139,9 @@ def fetch_meetings_for_date(date, max_retries=5):
         try:
             # --- API call
             params = fetch_params(date)
-            response = requests.get(BASE, params=params, headers=HEADERS, timeout=30)
+            with timer("scrape_fetch_seconds", page="meetings", status="error") as labels:
+                response = get_client().get(BASE, params=params, headers=HEADERS)
+                labels["status"] = response.status_code
             print(f"[{date}] Attempt {attempt}/{max_retries} → HTTP {response.status_code}")
 
             data = response.json() if response.content else {}
@@ -156,78 +166,266 @@ def fetch_meetings_for_date(date, max_retries=5):
 
         except Exception as e:
             last_err = e
-            if attempt == max_retries:
-                msg = f"Error on {date} after {max_retries} tries: {e}\n"
+            # replaying the same cached response again won't change the outcome
+            if attempt == max_retries or get_client().replay:
+                count("scrape_fetch_failures_total", page="meetings", outcome="give_up")
+                msg = f"Error on {date} after {attempt} tries: {e}\n"
                 print(msg)
                 with open("errors.txt", "a") as f:
                     f.write(msg)
                 return  # give up for this date
 
-            # custom backoff for PersistedQueryNotFound
-            if 'PersistedQueryNotFound' in str(e):
-                # longer delay: 3 minutes (150 seconds) + random jitter
-                delay = 150 + random.uniform(0, 30)  # 150-180 seconds
-                print(f"[{date}] PersistedQueryNotFound → Waiting longer: {delay:.1f}s…")
-            else:
-                # standard exponential backoff for other errors
-                delay = min(2 ** (attempt - 1), 8) + random.uniform(0, 0.5)
-                print(f"[{date}] Retry because: {e}. Waiting {delay:.1f}s…")
-            
-            time.sleep(delay)
+            backoff(date, attempt, e)
 
     # --- DB write after we have data
-    conn = sqlite3.connect("raw_racing_data.db")
-    cursor = conn.cursor()
+    load_meetings(meetings)
+
+
+def backoff(label, attempt, e):
+    count("scrape_fetch_failures_total", page="meetings", outcome="retry")
+    # custom backoff for PersistedQueryNotFound
+    if 'PersistedQueryNotFound' in str(e):
+        # longer delay: 3 minutes (150 seconds) + random jitter
+        delay = 150 + random.uniform(0, 30)  # 150-180 seconds
+        print(f"[{label}] PersistedQueryNotFound → Waiting longer: {delay:.1f}s…")
+    else:
+        # standard exponential backoff for other errors
+        delay = min(2 ** (attempt - 1), 8) + random.uniform(0, 0.5)
+        print(f"[{label}] Retry because: {e}. Waiting {delay:.1f}s…")
+
+    time.sleep(delay)
+
+
+def load_meetings(meetings):
+    with timer("scrape_parse_seconds", function="process_meeting"):
+        meeting_rows = [process_meeting(meeting) for meeting in meetings]
+    with timer("scrape_parse_seconds", function="process_race"):
+        race_rows = [
+            process_race(race, meeting.get("id", ""))
+            for meeting in meetings
+            for race in meeting.get("events", [])
+        ]
+
+    # queued on the shared writer, committed with the rest of its batch
+    with timer("scrape_load_seconds"):
+        get_writer().write(
+            ("INSERT OR IGNORE INTO meetings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", meeting_rows),
+            ("INSERT OR IGNORE INTO races VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", race_rows),
+        )
+    count("scrape_meetings_total", len(meeting_rows))
+    count("scrape_races_total", len(race_rows), outcome="listed")
+
+
+def request_meetings_window(start_date, end_date, limit, max_retries=5):
+    """All meeting groups for [start_date, end_date] in one request, or None on give-up."""
+    label = f"{start_date}..{end_date}"
 
-    for meeting in meetings:
-        cursor.execute("""
-            INSERT OR IGNORE INTO meetings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, process_meeting(meeting))
+    for attempt in range(1, max_retries + 1):
+        try:
+            params = fetch_params(start_date, end_date, limit)
+            with timer("scrape_fetch_seconds", page="meetings_window", status="error") as labels:
+                response = get_client().get(BASE, params=params, headers=HEADERS)
+                labels["status"] = response.status_code
+            print(f"[{label}] Attempt {attempt}/{max_retries} → HTTP {response.status_code}")
 
-        for race in meeting.get("events", []):
-            cursor.execute("""
-                INSERT OR IGNORE INTO races VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, process_race(race, meeting.get("id", "")))
+            data = response.json() if response.content else {}
+            if isinstance(data, dict) and data.get("errors"):
+                # GraphQL can return 200 + errors
+                raise RuntimeError(f"GraphQL errors: {data['errors']}")
+
+            return (data.get("data") or {}).get("meetingsGrouped", []) or []
+
+        except Exception as e:
+            # replaying the same cached response again won't change the outcome
+            if attempt == max_retries or get_client().replay:
+                count("scrape_fetch_failures_total", page="meetings_window", outcome="give_up")
+                msg = f"Error on {label} after {attempt} tries: {e}\n"
+                print(msg)
+                with open("errors.txt", "a") as f:
+                    f.write(msg)
+                return None
+
+            backoff(label, attempt, e)
+
+
+def meeting_date(meeting):
+    return meeting.get("meetingDateLocal") or meeting.get("meetingDateUtc", "")
+
+
+def fetch_meetings_window(start, end, limit=100, max_limit=1000):
+    """Meetings for a multi-day window, paging by splitting the window.
+
+    The persisted query has no cursor, so a window whose result looks truncated
+    (it hit `limit`, or nothing at all came back for its last day) is split in
+    half and each half re-requested; a single day that still hits the limit is
+    retried with a larger limit. Returns {date: [australian meetings]}; a day
+    still full at `max_limit` maps to None and is logged instead of loaded.
+    """
+    start_str, end_str = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+    groups = request_meetings_window(start_str, end_str, limit)
+    if groups is None:
+        return {}
+
+    all_meetings = [m for g in groups for m in (g.get("meetings") or [])]
+    truncated = len(all_meetings) >= limit or (
+        start < end and all_meetings and not any(meeting_date(m) == end_str for m in all_meetings)
+    )
+
+    if truncated and start < end:
+        mid = start + (end - start) / 2
+        mid = datetime(mid.year, mid.month, mid.day)
+        print(f"[{start_str}..{end_str}] {len(all_meetings)} meetings, splitting window")
+        by_day = fetch_meetings_window(start, mid, limit, max_limit)
+        by_day.update(fetch_meetings_window(mid + timedelta(1), end, limit, max_limit))
+        return by_day
+
+    if truncated and len(all_meetings) >= limit and limit < max_limit:
+        return fetch_meetings_window(start, end, min(limit * 2, max_limit), max_limit)
+
+    if truncated:
+        # can't split a day or raise the limit any further; loading it would drop meetings silently
+        msg = f"Error on {start_str}: {len(all_meetings)} meetings hit the limit of {limit}, day not loaded\n"
+        print(msg)
+        with open("errors.txt", "a") as f:
+            f.write(msg)
+        return {start_str: None}
+
+    # fan the australian meetings out per day
+    by_day = {}
+    g_index = fetch_meeting_group_index(groups)
+    for meeting in (groups[g_index].get("meetings") or []) if g_index is not None else []:
+        by_day.setdefault(meeting_date(meeting), []).append(meeting)
+
+    return by_day
+
+
+def fetch_meetings_for_window(start, end, limit=100):
+    by_day = fetch_meetings_window(start, end, limit)
+
+    for single_date in daterange(start, end):
+        date_str = single_date.strftime("%Y-%m-%d")
+        meetings = by_day.get(date_str)
+
+        if meetings is None and date_str in by_day:
+            continue        # over the limit, logged by fetch_meetings_window
+        if not meetings:
+            msg = f"Error on {date_str}: no Australia meetings in window {start:%Y-%m-%d}..{end:%Y-%m-%d}\n"
+            print(msg)
+            with open("errors.txt", "a") as f:
+                f.write(msg)
+            continue
+
+        load_meetings(meetings)
+        print(f"[{date_str}] Loaded {len(meetings)} meetings")
 
-    conn.commit()
-    conn.close()
 
-        
-        
 def daterange(start_date, end_date):
     for n in range(int((end_date - start_date).days) + 1):
         yield start_date + timedelta(n)
 
 
-def main(start_date=None, end_date="2025-06-30"):
+def main(start_date=None, end_date="2025-06-30", timeout=30, cache_dir="raw_cache", replay=False,
+         window_days=1, limit=100, metrics_file="metrics/scraper-graphql.prom", metrics_every=60):
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    configure(pool_size=1, timeout=(10, timeout), cache=cache, replay=replay)
+
     if not start_date:
         start_date = input("Enter a start date (YYYY-MM-DD) : ")
     start = datetime.strptime(start_date, "%Y-%m-%d")
     end = datetime.strptime(end_date, "%Y-%m-%d")
 
-    for single_date in daterange(start, end):
-        # convert date back to str
-        date_str = single_date.strftime("%Y-%m-%d")
-        print(f"Processing {date_str}...")
-        try:
-            # extract and load data
-            fetch_meetings_for_date(date_str)
-            # Wait between 10–15 seconds (very polite timing)
-            time.sleep(random.uniform(5, 10))
+    # an existing db picks up any new tables / indexes first
+    migrate()
+
+    # meetings and races go through one batching writer thread
+    writer = start_writer()
+    # timings and counters to the scrape_metrics table and a Prometheus text file, summary at the end
+    start_telemetry("graphql", writer, metrics_file, flush_every=metrics_every)
+    try:
+        if window_days > 1:
+            window_start = start
+            while window_start <= end:
+                window_end = min(window_start + timedelta(window_days - 1), end)
+                print(f"Processing {window_start:%Y-%m-%d}..{window_end:%Y-%m-%d}...")
+                try:
+                    fetch_meetings_for_window(window_start, window_end, limit)
+                    if not replay:
+                        time.sleep(random.uniform(5, 10))
+
+                except Exception as e:
+                    # one bad window is logged like a bad day; the backfill carries on with the next
+                    error_message = f"Error on {window_start:%Y-%m-%d}..{window_end:%Y-%m-%d}: {e}\n"
+                    print(error_message)
+                    with open("errors.txt", "a") as f:
+                        f.write(error_message)
+
+                window_start = window_end + timedelta(1)
+                print()
+            return
+
+        for single_date in daterange(start, end):
+            # convert date back to str
+            date_str = single_date.strftime("%Y-%m-%d")
+            print(f"Processing {date_str}...")
+            try:
+                # extract and load data
+                with timer("scrape_meetings_date_seconds"):
+                    fetch_meetings_for_date(date_str)
+                # Wait between 10–15 seconds (very polite timing)
+                if not replay:
+                    time.sleep(random.uniform(5, 10))
             
-        except Exception as e:
-            error_message = f"Error on {date_str}: {e}\n"
-            print(error_message)
+            except Exception as e:
+                error_message = f"Error on {date_str}: {e}\n"
+                print(error_message)
 
-            # Save the error to a file
-            with open("errors.txt", "a") as f:
-                f.write(error_message)
+                # Save the error to a file
+                with open("errors.txt", "a") as f:
+                    f.write(error_message)
         
-        print()
+            print()
+
+    finally:
+        stop_telemetry()
+        stop_writer()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Scrape puntapi meetings and races into raw_racing_data.db")
+    parser.add_argument("--start", help="start date (YYYY-MM-DD), prompted for if omitted")
+    parser.add_argument("--end", default="2025-06-30", help="end date (YYYY-MM-DD)")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds to wait for a response before retrying")
+    parser.add_argument("--cache-dir", default="raw_cache",
+                        help="where every fetched response is stored (compressed)")
+    parser.add_argument("--no-cache", action="store_true", help="don't store fetched responses")
+    parser.add_argument("--replay", action="store_true",
+                        help="re-parse and load responses from --cache-dir without touching the network")
+    parser.add_argument("--window-days", type=int, default=1,
+                        help="days per request; windows that come back full are split and re-requested")
+    parser.add_argument("--limit", type=int, default=100,
+                        help="meetings per request (windowed mode)")
+    parser.add_argument("--metrics-file", default="metrics/scraper-graphql.prom",
+                        help="Prometheus text file the run's metrics are written to ('' for none)")
+    parser.add_argument("--metrics-every", type=float, default=60,
+                        help="seconds between metrics snapshots (file and scrape_metrics table)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="split the range into shards worked by this many processes (leased in the db)")
+    parser.add_argument("--shard-days", type=int, default=30, help="days per shard with --workers")
+    parser.add_argument("--lease-seconds", type=float, default=600,
+                        help="a shard whose worker stops renewing for this long is handed to another")
+    args = parser.parse_args()
+
+    run_shard = partial(main, timeout=args.timeout, cache_dir=None if args.no_cache else args.cache_dir,
+                        replay=args.replay, window_days=args.window_days, limit=args.limit,
+                        metrics_file=args.metrics_file, metrics_every=args.metrics_every)
+    if args.workers:
+        start_date = args.start or input("Enter a start date (YYYY-MM-DD) : ")
+        # replays shard separately, so replaying a range never marks it scraped
+        run_sharded("graphql-replay" if args.replay else "graphql", run_shard, start_date, args.end,
+                    args.shard_days, args.workers, args.lease_seconds)
+    else:
+        run_shard(args.start, args.end)
 
 # start_date="2015-01-01", end_date="2025-06-30"
 
@@ -1,131 +1,37 @@
-import requests
 from bs4 import BeautifulSoup
-import sqlite3
 import random
 import time
-from datetime import datetime, timedelta
-
-
-
-USER_AGENTS = [
-    # Chrome ‑ Windows
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/137.0.0.0 Safari/537.36",                     
-
-    # Chrome ‑ macOS
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/137.0.0.0 Safari/537.36",                    
-
-    # Chrome ‑ Linux
-    "Mozilla/5.0 (X11; Linux x86_64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/136.0.0.0 Safari/537.36",                     
-
-    # Chrome ‑ Android
-    "Mozilla/5.0 (Linux; Android 10; K) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/126.0.0.0 Mobile Safari/537.36",               
-
-    # Chrome (CriOS) ‑ iPhone
-    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_3 like Mac OS X) "
-    "AppleWebKit/605.1.15 (KHTML, like Gecko) "
-    "CriOS/126.0.0.0 Mobile/15E148 Safari/604.1",           
-
-    # Firefox ‑ Windows
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) "
-    "Gecko/20100101 Firefox/128.0",                        
-
-    # Firefox ‑ Linux
-    "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) "
-    "Gecko/20100101 Firefox/128.0",                         
-
-    # Safari 18 ‑ macOS
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) "
-    "AppleWebKit/605.1.15 (KHTML, like Gecko) "
-    "Version/18.0 Safari/605.1.15",                        
-
-    # Edge 126 ‑ Windows (clean)
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/126.0.0.0 Safari/537.36 Edg/126.0.0.0",          
-
-    # Edge 126 ‑ Windows (full string)
-    "mozilla/5.0 (windows nt 10.0; win64; x64) "
-    "applewebkit/537.36 (khtml, like gecko) "
-    "chrome/126.0.0.0 safari/537.36 edg/126.0.0.0 "
-    "gls/100.10.9252.92",                                  
-
-    # Opera 120 ‑ Windows
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/126.0.0.0 Safari/537.36 OPR/120.0.5543.53",     
-
-    # Brave 134 ‑ Windows
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/134.0.0.0 Safari/537.36 Brave/134.0.0.1"        
-]
-
-def get_random_header():
-    return {
-        "User-Agent": random.choice(USER_AGENTS),
-        "Accept": "text/html,application/xhtml+xml,"
-                  "application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": random.choice([
-            "en-US,en;q=0.9", "en-US;q=0.8"
-        ]),
-        "Accept-Encoding": "gzip, deflate",
-        "Connection": "keep-alive",
-        "Referer": "https://www.racenet.com.au/",
-        "Upgrade-Insecure-Requests": "1",
-        "DNT": "1"
-    }
-
-
-def fetch_slugs(date):
-    conn = sqlite3.connect("raw_racing_data.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-                    SELECT 
-                        meetings.meeting_id AS meeting_id, 
-                        races.race_id AS race_id,
-                        meetings.date_utc AS date,
-                        meetings.slug AS meeting_slug, 
-                        races.slug AS race_slug 
-                    FROM races
-                    LEFT JOIN meetings ON races.meeting_id = meetings.meeting_id
-                    WHERE date = (?)
-                """, (date,))
-    rows = cursor.fetchall()
-    conn.close()
-    
-    return rows
-
-
-def fetch_soup(url, max_retries=5):
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = requests.get(url, headers=get_random_header())
-            ok = resp.status_code == 200
-
-
-            print(f"Attempt {attempt}/{max_retries} → HTTP {resp.status_code}")
-
-            if not ok:
-                raise ValueError(f"status {resp.status_code}")
-
-            return BeautifulSoup(resp.content, "lxml")
-        
-        except Exception as e:
-            if attempt == max_retries:
-                raise
-            
-            # 2 minutes * attempt number + random jitter [2, 4, 6, 8, 10]
-            delay = (120 * attempt) + random.uniform(0, 30)
-            print(f"Error on {url}")
-            time.sleep(delay)
+import argparse
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+from datetime import datetime
+
+import racenet_lxml
+from db_writer import get_writer, start_writer, stop_writer
+from horse_identity import INSERT_IDENTITY, identity_rows
+from http_client import configure, get_client
+from leases import run_sharded
+from migrations import migrate
+from response_cache import CacheMiss, ResponseCache
+from retry_scheduler import RetryLater, RetryScheduler
+from scrape_jobs import PAGES, JobQueue
+from telemetry import count, get_telemetry, start_telemetry, stop_telemetry, timed, timer
+
+
+def fetch_body(url, attempt=1, max_retries=5, page=""):
+    # one attempt; failures are retried later through the RetryScheduler
+    with timer("scrape_fetch_seconds", page=page, status="error") as labels:
+        resp = get_client().get(url)
+        labels["status"] = resp.status_code
+    print(f"Attempt {attempt}/{max_retries} → HTTP {resp.status_code}")
+
+    if resp.status_code != 200:
+        raise ValueError(f"status {resp.status_code}")
+
+    return resp.content
 
     
 def process_race_details(soup: BeautifulSoup):
@@ -378,25 +284,43 @@ def process_form(soup: BeautifulSoup) -> list[dict]:
     return results
 
 
-def extract_and_load_race(slug: str, meeting_id: str, race_id: str):
-    # build urls 
-    result_url   = f"https://www.racenet.com.au/results/horse-racing/{slug}"
-    overview_url = f"https://www.racenet.com.au/form-guide/horse-racing/{slug}/overview"
-    form_url     = f"https://www.racenet.com.au/form-guide/horse-racing/{slug}/full-form"
+def pause(low, high):
+    # no one to be polite to when replaying from the cache
+    if not get_client().replay:
+        time.sleep(random.uniform(low, high))
 
-    # scrape pages (process inbetween requests -> time taken to process adds to the sleep time per request)
-    race_soup   = fetch_soup(result_url)
-    race_details = process_race_details(race_soup)
-    race_results = process_results(race_soup)
-    time.sleep(random.uniform(0, 1))
-    
-    overview_soup = fetch_soup(overview_url)
-    overview = process_overview(overview_soup)
-    time.sleep(random.uniform(0, 1))
-    
-    form_soup = fetch_soup(form_url)
-    form_stats = process_form(form_soup)
-    time.sleep(random.uniform(0, 1))
+
+# page parser -> (parse page bytes, race details, results, overview, form)
+PARSE_STEPS = ("parse_page", "process_race_details", "process_results", "process_overview", "process_form")
+PARSERS = {
+    "bs4": (lambda body: BeautifulSoup(body, "lxml"),
+            process_race_details, process_results, process_overview, process_form),
+    "lxml": (racenet_lxml.parse_page,
+             racenet_lxml.process_race_details, racenet_lxml.process_results,
+             racenet_lxml.process_overview, racenet_lxml.process_form),
+}
+
+
+def race_urls(slug: str) -> list[str]:
+    # results, overview and full-form pages for one race
+    return [
+        f"https://www.racenet.com.au/results/horse-racing/{slug}",
+        f"https://www.racenet.com.au/form-guide/horse-racing/{slug}/overview",
+        f"https://www.racenet.com.au/form-guide/horse-racing/{slug}/full-form",
+    ]
+
+
+def build_race_rows(race_page: bytes, overview_page: bytes, form_page: bytes, parser="bs4"):
+    parse, parse_details, parse_results, parse_overview, parse_form = (
+        timed(fn, "scrape_parse_seconds", parser=parser, function=step)
+        for fn, step in zip(PARSERS[parser], PARSE_STEPS)
+    )
+
+    race_soup = parse(race_page)
+    race_details = parse_details(race_soup)
+    race_results = parse_results(race_soup)
+    overview = parse_overview(parse(overview_page))
+    form_stats = parse_form(parse(form_page))
 
     # merge overview + form into dicts keyed by horse name
     overview_map = {row["Name"]: row for row in overview}
@@ -409,18 +333,25 @@ def extract_and_load_race(slug: str, meeting_id: str, race_id: str):
                   **overview_map.get(name, {}),
                   **form_map.get(name, {})}
         combined.append(merged)
-        
-    # loading data
-    conn   = sqlite3.connect("raw_racing_data.db")
-    cursor = conn.cursor()
 
+    return race_details, combined
+
+
+def build_race_rows_measured(race_page: bytes, overview_page: bytes, form_page: bytes, parser="bs4"):
+    # in a parse worker process: its parse timings go back to the parent with the rows
+    rows = build_race_rows(race_page, overview_page, form_page, parser)
+    return rows, get_telemetry().drain()
+
+
+def load_race(meeting_id: str, race_id: str, race_details: dict, combined: list[dict], date=None):
     # race_details table  (one row per race)
-    cursor.execute("""
+    details_sql = """
         INSERT OR IGNORE INTO race_details (
             race_id, total_prize, first_prize, second_prize, third_prize,
             winning_time, sectional_time, track_rail_info
         ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    """
+    details_row = (
         race_id,
         race_details.get("Prize", ""),
         race_details.get("1st", ""),
@@ -429,7 +360,7 @@ def extract_and_load_race(slug: str, meeting_id: str, race_id: str):
         race_details.get("Time", ""),
         race_details.get("Sectional Time", ""),
         race_details.get("Track Info", "")
-    ))
+    )
     
     # horse_results table  (one row per runner)
     insert_sql = """
@@ -446,12 +377,16 @@ def extract_and_load_race(slug: str, meeting_id: str, race_id: str):
             first_up, second_up, third_up, class,
             group1, group2, group3, listed,
             clockwise, a_clockwise, night, synthetic,
-            as_fav, roi
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            as_fav, roi, horse_id
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
     """
 
-    for h in combined:
-        cursor.execute(insert_sql, (
+    # resolve every runner to its horse_identity id as it's loaded
+    horse_ids, identities = identity_rows(
+        (h.get("Name"), h.get("Sire"), h.get("Dam"), h.get("Age"), date) for h in combined
+    )
+
+    runner_rows = [(
             meeting_id, race_id,
             h.get("Position", ""),
             h.get("RunningNumber", ""),
@@ -509,47 +444,463 @@ def extract_and_load_race(slug: str, meeting_id: str, race_id: str):
             h.get("Night", ""),
             h.get("Synthetic", ""),
             h.get("As Fav", ""),
-            h.get("ROI $", "")
-        ))
+            h.get("ROI $", ""),
+            horse_id
+        ) for h, horse_id in zip(combined, horse_ids)]
 
-    conn.commit()
-    conn.close()
+    # queued on the shared writer, which commits many races per transaction; one
+    # unit, so a race never ends up with details but no runners
+    get_writer().write((details_sql, [details_row]), (INSERT_IDENTITY, identities), (insert_sql, runner_rows))
+
+
+def cached_body(url):
+    # pages finished on an earlier run come back from the response cache
+    cache = get_client().cache
+    return cache.get(url) if cache is not None else None
+
+
+def page_failed(retries, url, page, race_id, jobs, e):
+    # park the page for a later attempt, or give up on it (and its race)
+    delay = retries.failed(url, e, retryable=not isinstance(e, CacheMiss))
+    count("scrape_fetch_failures_total", page=page, outcome="give_up" if delay is None else "retry")
+
+    if delay is None:
+        if jobs:
+            jobs.mark_failed(race_id, page, e)
+        raise e
+
+    if jobs:
+        jobs.mark_retrying(race_id, page, f"attempt {retries.attempt(url) - 1} failed, retrying in {delay:.0f}s: {e}")
+    raise RetryLater(delay)
+
+
+def extract_and_load_race(slug: str, meeting_id: str, race_id: str, jobs=None, done_pages=(), parser="bs4",
+                          retries=None, bodies=None, date=None):
+    """Fetch, parse and load one race.
+
+    A failed page raises RetryLater and leaves the pages fetched so far in
+    `bodies`; call again with the same dict once the retry is due.
+    """
+    retries = retries or RetryScheduler()
+    bodies = {} if bodies is None else bodies
+
+    for page, url in zip(PAGES, race_urls(slug)):
+        if page in bodies:
+            continue
+        body = cached_body(url) if page in done_pages else None
+
+        if body is None:
+            try:
+                body = fetch_body(url, retries.attempt(url), retries.max_attempts, page)
+            except Exception as e:
+                page_failed(retries, url, page, race_id, jobs, e)
+
+            retries.succeeded(url)
+            if jobs:
+                jobs.mark_done(race_id, page)
+            # sleep inbetween requests
+            pause(0, 1)
+
+        bodies[page] = body
+
+    race_details, combined = build_race_rows(*(bodies[page] for page in PAGES), parser=parser)
+    with timer("scrape_load_seconds"):
+        load_race(meeting_id, race_id, race_details, combined, date)
+    count("scrape_races_total", outcome="loaded")
     print(f"Loaded race {race_id} ({slug})")
     print()
 
 
-def daterange(start_date, end_date):
-    for n in range(int((end_date - start_date).days) + 1):
-        yield start_date + timedelta(n)
+class HostThrottle:
+    """Politeness budget shared by every request: at most one request per host
+    every `min_interval` (+ jitter) seconds, however many are in flight."""
 
+    def __init__(self, min_interval: float = 0.5, jitter: float = 0.5):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self.next_slot = {}
 
-def main(start_date=None, end_date="2025-06-30"):
-    if not start_date:
-        start_date = input("Enter a start date (YYYY-MM-DD) : ")
-    start = datetime.strptime(start_date, "%Y-%m-%d")
-    end = datetime.strptime(end_date, "%Y-%m-%d")
+    async def wait(self, url: str):
+        host = urlsplit(url).netloc
+        now = asyncio.get_running_loop().time()
 
-    for single_date in daterange(start, end):
-        date_str = single_date.strftime("%Y-%m-%d")
-        
-        races = fetch_slugs(date_str)
-        
-        for meeting_id, race_id, date, meeting_slug, race_slug in races:
-            slug = f"{meeting_slug}/{race_slug}"
+        # reserve the next free slot for this host before sleeping
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.min_interval + random.uniform(0, self.jitter)
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def fetch_body_async(url, throttle: HostThrottle, in_flight: asyncio.Semaphore, attempt=1, max_retries=5,
+                           page=""):
+    async with in_flight:
+        await throttle.wait(url)
+        # the request alone; waiting for a slot or the throttle isn't fetch latency
+        with timer("scrape_fetch_seconds", page=page, status="error") as labels:
+            resp = await asyncio.to_thread(get_client().get, url)
+            labels["status"] = resp.status_code
+
+    print(f"Attempt {attempt}/{max_retries} → HTTP {resp.status_code}")
+
+    if resp.status_code != 200:
+        raise ValueError(f"status {resp.status_code}")
 
+    return resp.content
+
+
+async def fetch_page_async(url, page, race_id, throttle, in_flight, retries, jobs, done_pages, bodies):
+    body = cached_body(url) if page in done_pages else None
+
+    if body is None:
+        try:
+            body = await fetch_body_async(url, throttle, in_flight, retries.attempt(url), retries.max_attempts,
+                                          page)
+        except Exception as e:
+            page_failed(retries, url, page, race_id, jobs, e)
+
+        retries.succeeded(url)
+        if jobs:
+            jobs.mark_done(race_id, page)
+
+    bodies[page] = body
+
+
+async def fetch_race_async(slug, race_id, throttle, in_flight, retries, jobs=None, done_pages=(),
+                           bodies=None) -> list[bytes]:
+    """Bodies of the race's three pages.
+
+    Pages already in `bodies` (from an earlier try) aren't fetched again. If any
+    page is parked for a retry this raises RetryLater for the latest of them.
+    """
+    bodies = {} if bodies is None else bodies
+    outcomes = await asyncio.gather(
+        *(fetch_page_async(url, page, race_id, throttle, in_flight, retries, jobs, done_pages, bodies)
+          for page, url in zip(PAGES, race_urls(slug)) if page not in bodies),
+        return_exceptions=True,
+    )
+
+    # a page that was given up on sinks the race; otherwise wait for the slowest retry
+    errors = [e for e in outcomes if isinstance(e, Exception)]
+    for e in errors:
+        if not isinstance(e, RetryLater):
+            raise e
+    if errors:
+        raise RetryLater(max(e.delay for e in errors))
+
+    return [bodies[page] for page in PAGES]
+
+
+class StageStats:
+    """Items finished and seconds spent busy for one pipeline stage."""
+
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+
+    def record(self, seconds: float):
+        self.items += 1
+        self.busy += seconds
+
+    def line(self, elapsed: float) -> str:
+        # busy share of what the stage's workers could have done; the stage
+        # closest to 100% is the bottleneck
+        elapsed = max(elapsed, 1e-9)
+        return (f"{self.name} {self.items} ({self.items / elapsed * 3600:.0f}/h, "
+                f"{self.busy / (elapsed * self.workers):.0%} of {self.workers})")
+
+
+def report_pipeline(stages, queues, started):
+    elapsed = time.perf_counter() - started
+    depths = " ".join(f"{name} q={q.qsize()}/{q.maxsize}" for name, q in queues.items())
+    print(f"[pipeline {elapsed:.0f}s] {depths} | " + " | ".join(s.line(elapsed) for s in stages))
+
+
+def log_race_error(slug, e):
+    count("scrape_races_total", outcome="error")
+    error_message = f"Error on {slug}: {e}\n"
+    print(error_message)
+
+    # Save the error to a file
+    with open("errors.txt", "a") as f:
+        f.write(error_message)
+
+
+def next_race(retries, races):
+    # a race whose retry is due goes before a new one; new ones have no pages yet
+    race = retries.pop_due()
+    if race is None:
+        race = next(races, None)
+        if race is not None:
+            race = (*race, {})
+    return race
+
+
+async def run_async(races, jobs=None, concurrency=8, min_interval=0.5, parser="bs4",
+                    parse_workers=None, queue_size=32, report_every=30, retries=None):
+    """Fetch -> parse -> load pipeline.
+
+    Race tasks fetch pages and put the bodies on a bounded queue; a process
+    pool parses them on every core while fetching carries on; one loader
+    writes the rows. A full queue slows the stage in front of it down.
+
+    A race with a failed page gives its slot up and waits in `retries` until
+    the page is due again, so it never holds up the races behind it.
+    """
+    retries = retries or RetryScheduler()
+    loop = asyncio.get_running_loop()
+    parse_workers = parse_workers or os.cpu_count() or 1
+
+    # start the parse workers before any threads exist, so forking them is safe
+    pool = ProcessPoolExecutor(max_workers=parse_workers)
+    await loop.run_in_executor(pool, int)
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    # `in_flight` caps open requests, `throttle` spaces them out per host
+    in_flight = asyncio.Semaphore(concurrency)
+    throttle = HostThrottle(0, 0) if get_client().replay else HostThrottle(min_interval)
+
+    fetched = asyncio.Queue(maxsize=queue_size)
+    parsed = asyncio.Queue(maxsize=queue_size)
+    fetch_stats = StageStats("fetch", concurrency)
+    parse_stats = StageStats("parse", parse_workers)
+    load_stats = StageStats("load")
+    started = time.perf_counter()
+
+    async def run_race(meeting_id, race_id, date, slug, done_pages, fetched_pages):
+        try:
+            print(f"Processing: [{date}, {meeting_id}, {race_id}] {slug}")
+            t0 = time.perf_counter()
+            bodies = await fetch_race_async(slug, race_id, throttle, in_flight, retries, jobs, done_pages,
+                                            fetched_pages)
+            fetch_stats.record(time.perf_counter() - t0)
+        except RetryLater as e:
+            # keep the pages we have, come back when the failed one is due
+            retries.defer((meeting_id, race_id, date, slug, done_pages, fetched_pages), e.delay)
+            return
+        except Exception as e:
+            log_race_error(slug, e)
+            return
+
+        await fetched.put((meeting_id, race_id, date, slug, bodies))
+
+    async def parse_stage():
+        while (item := await fetched.get()) is not None:
+            meeting_id, race_id, date, slug, bodies = item
             try:
-                print(f"Processing: [{date}, {meeting_id}, {race_id}] {slug}")
-                extract_and_load_race(slug, meeting_id, race_id)
+                t0 = time.perf_counter()
+                rows, timings = await loop.run_in_executor(pool, partial(build_race_rows_measured, *bodies,
+                                                                         parser=parser))
+                parse_stats.record(time.perf_counter() - t0)
+                get_telemetry().merge(timings)
             except Exception as e:
-                error_message = f"Error on {slug}: {e}\n"
-                print(error_message)
+                log_race_error(slug, e)
+                continue
 
-                # Save the error to a file
-                with open("errors.txt", "a") as f:
-                    f.write(error_message)
-                
-            
-if __name__ == "__main__":
-    main()
+            await parsed.put((meeting_id, race_id, date, slug, rows))
+
+    async def load_stage():
+        while (item := await parsed.get()) is not None:
+            meeting_id, race_id, date, slug, (race_details, combined) = item
+            try:
+                t0 = time.perf_counter()
+                with timer("scrape_load_seconds"):
+                    load_race(meeting_id, race_id, race_details, combined, date)
+                load_stats.record(time.perf_counter() - t0)
+            except Exception as e:
+                log_race_error(slug, e)
+                continue
+
+            count("scrape_races_total", outcome="loaded")
+            print(f"Loaded race {race_id} ({slug})")
+            print()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_every)
+            report_pipeline((fetch_stats, parse_stats, load_stats), {"fetched": fetched, "parsed": parsed}, started)
+            print(f"[pipeline] {retries.summary()}")
+
+    parsers = [asyncio.create_task(parse_stage()) for _ in range(parse_workers)]
+    loader = asyncio.create_task(load_stage())
+    reporting = asyncio.create_task(reporter())
+
+    races = iter(races)
+    pending = set()
+    while True:
+        # keep enough races open to fill every request slot, across days; races
+        # whose retry is due go first
+        while len(pending) < concurrency:
+            race = next_race(retries, races)
+            if race is None:
+                break
+            pending.add(asyncio.create_task(run_race(*race)))
+
+        wait = retries.wait_time()
+        if not pending and wait is None:
+            break
+        if not pending:
+            await asyncio.sleep(wait)
+            continue
 
-# start_date="2015-01-01", end_date="2025-06-30"
\ No newline at end of file
+        # wake up for a finished race, or when the next retry is due
+        _, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+
+    # drain: one stop marker per parser, then one for the loader
+    for _ in parsers:
+        await fetched.put(None)
+    await asyncio.gather(*parsers)
+    await parsed.put(None)
+    await loader
+
+    reporting.cancel()
+    pool.shutdown()
+    report_pipeline((fetch_stats, parse_stats, load_stats), {"fetched": fetched, "parsed": parsed}, started)
+    print(f"[pipeline] {retries.summary()}")
+
+
+def run_serial(races, jobs=None, parser="bs4", retries=None):
+    # one race at a time, but a race waiting on a retry doesn't stop the next one
+    retries = retries or RetryScheduler()
+    races = iter(races)
+
+    while True:
+        race = next_race(retries, races)
+        if race is None:
+            wait = retries.wait_time()
+            if wait is None:
+                break
+            # nothing new left, sleep until the next retry is due
+            time.sleep(wait)
+            continue
+
+        meeting_id, race_id, date, slug, done_pages, bodies = race
+        try:
+            print(f"Processing: [{date}, {meeting_id}, {race_id}] {slug}")
+            extract_and_load_race(slug, meeting_id, race_id, jobs, done_pages, parser, retries, bodies, date)
+        except RetryLater as e:
+            retries.defer(race, e.delay)
+        except Exception as e:
+            log_race_error(slug, e)
+
+    print(f"Fetch {retries.summary()}")
+
+
+def main(start_date=None, end_date="2025-06-30", mode="serial", concurrency=8, min_interval=0.5,
+         pool_size=None, timeout=30, cache_dir="raw_cache", replay=False, max_attempts=3, parser="bs4",
+         parse_workers=None, queue_size=32, report_every=30, fetch_attempts=5,
+         metrics_file="metrics/scraper-race.prom", metrics_every=60):
+    """Scrape the races in [start_date, end_date]; returns how many are still
+    unfinished (failed this run, but not yet given up on)."""
+    # racenet pool sized to the number of requests we keep in flight
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    configure(pool_size=pool_size or concurrency, timeout=(10, timeout), cache=cache, replay=replay)
+
+    if not start_date:
+        start_date = input("Enter a start date (YYYY-MM-DD) : ")
+    # validate the dates before planning
+    datetime.strptime(start_date, "%Y-%m-%d")
+    datetime.strptime(end_date, "%Y-%m-%d")
+
+    # an existing db picks up any new tables / indexes first
+    migrate()
+
+    # every row and job update goes through one batching writer thread
+    writer = start_writer()
+    # timings and counters to the scrape_metrics table and a Prometheus text file, summary at the end
+    start_telemetry("race", writer, metrics_file, flush_every=metrics_every)
+    jobs = JobQueue(writer=writer)
+    planned = jobs.plan(start_date, end_date)
+    print(f"Planned {planned} new page jobs between {start_date} and {end_date}")
+
+    if replay:
+        # re-parse every race in the range from the cache, job state untouched
+        races = jobs.pending(start_date, end_date, everything=True)
+        jobs.close()
+        jobs = None
+    else:
+        races = jobs.pending(start_date, end_date, max_attempts)
+    print(f"{len(races)} races to scrape")
+
+    retries = RetryScheduler(max_attempts=fetch_attempts)
+    if mode == "async":
+        asyncio.run(run_async(races, jobs, concurrency, min_interval, parser,
+                              parse_workers, queue_size, report_every, retries))
+    else:
+        run_serial(races, jobs, parser, retries)
+
+    if jobs:
+        print(f"Jobs: {jobs.summary(start_date, end_date)}")
+        jobs.close()
+    stop_telemetry()
+    stop_writer()
+
+    if replay:
+        # job state is untouched, and a page missing from the cache won't be there next time either
+        return 0
+    jobs = JobQueue()
+    unfinished = len(jobs.pending(start_date, end_date, max_attempts))
+    jobs.close()
+    return unfinished
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape racenet race pages into raw_racing_data.db")
+    parser.add_argument("--start", help="start date (YYYY-MM-DD), prompted for if omitted")
+    parser.add_argument("--end", default="2025-06-30", help="end date (YYYY-MM-DD)")
+    parser.add_argument("--mode", choices=["serial", "async"], default="serial",
+                        help="serial: one request at a time, async: many races in flight")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="async mode: max requests in flight")
+    parser.add_argument("--min-interval", type=float, default=0.5,
+                        help="async mode: min seconds between requests to the same host")
+    parser.add_argument("--pool-size", type=int,
+                        help="keep-alive connections per host (defaults to --concurrency)")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds to wait for a response before retrying")
+    parser.add_argument("--cache-dir", default="raw_cache",
+                        help="where every fetched page is stored (compressed)")
+    parser.add_argument("--no-cache", action="store_true", help="don't store fetched pages")
+    parser.add_argument("--replay", action="store_true",
+                        help="re-parse and load pages from --cache-dir without touching the network")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="skip pages that have already failed this many runs")
+    parser.add_argument("--parser", choices=list(PARSERS), default="bs4",
+                        help="page parser: BeautifulSoup, or precompiled lxml XPath (same rows, faster)")
+    parser.add_argument("--parse-workers", type=int,
+                        help="async mode: parser processes (defaults to the number of cores)")
+    parser.add_argument("--queue-size", type=int, default=32,
+                        help="async mode: races buffered between fetch, parse and load")
+    parser.add_argument("--report-every", type=float, default=30,
+                        help="async mode: seconds between queue depth / throughput reports")
+    parser.add_argument("--fetch-attempts", type=int, default=5,
+                        help="tries per page within a run; failed pages wait in a retry queue meanwhile")
+    parser.add_argument("--metrics-file", default="metrics/scraper-race.prom",
+                        help="Prometheus text file the run's metrics are written to ('' for none)")
+    parser.add_argument("--metrics-every", type=float, default=60,
+                        help="seconds between metrics snapshots (file and scrape_metrics table)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="split the range into shards worked by this many processes (leased in the db)")
+    parser.add_argument("--shard-days", type=int, default=7, help="days per shard with --workers")
+    parser.add_argument("--lease-seconds", type=float, default=600,
+                        help="a shard whose worker stops renewing for this long is handed to another")
+    args = parser.parse_args()
+
+    run_shard = partial(main, mode=args.mode, concurrency=args.concurrency, min_interval=args.min_interval,
+                        pool_size=args.pool_size, timeout=args.timeout,
+                        cache_dir=None if args.no_cache else args.cache_dir, replay=args.replay,
+                        max_attempts=args.max_attempts, parser=args.parser, parse_workers=args.parse_workers,
+                        queue_size=args.queue_size, report_every=args.report_every,
+                        fetch_attempts=args.fetch_attempts, metrics_file=args.metrics_file,
+                        metrics_every=args.metrics_every)
+    if args.workers:
+        start_date = args.start or input("Enter a start date (YYYY-MM-DD) : ")
+        # replays shard separately, so replaying a range never marks it scraped
+        run_sharded("race-replay" if args.replay else "race", run_shard, start_date, args.end, args.shard_days,
+                    args.workers, args.lease_seconds)
+    else:
+        run_shard(args.start, args.end)
+
+# start_date="2015-01-01", end_date="2025-06-30"
@@ -0,0 +1,301 @@
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+# every metric the scrapers record: name -> help text. *_seconds are timings, *_total counters
+METRICS = {
+    "scrape_fetch_seconds": "HTTP request time per page / API call, by response status",
+    "scrape_parse_seconds": "time in each page / response parsing function",
+    "scrape_load_seconds": "time to turn parsed rows into db rows and queue them on the writer",
+    "scrape_db_commit_seconds": "db writer transaction time",
+    "scrape_meetings_date_seconds": "fetch_meetings_for_date, retries and backoff included",
+    "scrape_fetch_failures_total": "failed fetches, by whether they are retried or given up on",
+    "scrape_races_total": "races loaded / failed (race scraper) or listed (graphql scraper)",
+    "scrape_meetings_total": "meetings loaded",
+    "scrape_db_rows_total": "rows committed by the db writer",
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# timings go in log-spaced buckets 2^(1/8) apart, so a quantile is within ~4.5% whatever the
+# run length; a multi-day backfill keeps a few hundred counts per series, not every value
+BUCKETS_PER_DOUBLING = 8
+
+# one row per series per flush; counts and quantiles are for the whole run so far
+CREATE_SCRAPE_METRICS = """
+CREATE TABLE IF NOT EXISTS scrape_metrics (
+    run_id TEXT,
+    scraper TEXT,
+    recorded_at TEXT,
+    metric TEXT,
+    labels TEXT,
+    count REAL,
+    sum REAL,
+    p50 REAL,
+    p95 REAL,
+    p99 REAL,
+    max REAL
+)
+"""
+
+INSERT_METRIC = "INSERT INTO scrape_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def series_key(name: str, labels: dict) -> tuple:
+    # label values as text, so a status of 200 and one of "error" sort and print alike
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Timing:
+    """Count, sum, max and a log-bucket histogram of one timed series."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        bucket = math.floor(math.log2(max(seconds, 1e-9)) * BUCKETS_PER_DOUBLING)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: "Timing"):
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        for bucket, n in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+
+    def quantile(self, q: float) -> float:
+        # geometric middle of the bucket holding the q-th value
+        rank, seen = q * self.count, 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** ((bucket + 0.5) / BUCKETS_PER_DOUBLING), self.max)
+        return self.max
+
+
+class Telemetry:
+    """Timings and counters for one scraper run.
+
+    Series are keyed by metric name plus labels. Every `flush_every` seconds
+    (and on close) a snapshot goes to the scrape_metrics table, through the
+    shared db writer, and to `metrics_file` in Prometheus text format, for
+    node_exporter's textfile collector or a quick look with cat. Every
+    Prometheus series also carries `labels` (the scraper, and the worker when
+    several processes each write a file).
+    """
+
+    def __init__(self, scraper: str = "", writer=None, metrics_file=None, flush_every=60.0, labels=None):
+        self.scraper = scraper
+        self.writer = writer
+        self.metrics_file = metrics_file
+        self.labels = {"scraper": scraper, **(labels or {})}
+        self.run_id = f"{scraper}-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.timings = {}       # (name, labels) -> Timing
+        self.counters = {}      # (name, labels) -> number
+
+        self.stop = threading.Event()
+        if writer is not None or metrics_file:
+            threading.Thread(target=self.flush_loop, args=(flush_every,), name="telemetry", daemon=True).start()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = series_key(name, labels)
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = Timing()
+            timing.observe(seconds)
+
+    def count(self, name: str, n=1, **labels):
+        key = series_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def drain(self) -> tuple[dict, dict]:
+        """Everything recorded so far, which is then forgotten; merge() it elsewhere."""
+        with self.lock:
+            snapshot = (self.timings, self.counters)
+            self.timings, self.counters = {}, {}
+        return snapshot
+
+    def merge(self, snapshot: tuple[dict, dict]):
+        timings, counters = snapshot
+        with self.lock:
+            for key, timing in timings.items():
+                self.timings.setdefault(key, Timing()).merge(timing)
+            for key, n in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + n
+
+    def total(self, name: str, **labels) -> float:
+        # sum of a counter over every series carrying at least these labels
+        wanted = set(series_key(name, labels)[1])
+        with self.lock:
+            return sum(n for (metric, key), n in self.counters.items() if metric == name and wanted <= set(key))
+
+    def metric_rows(self) -> list[tuple]:
+        recorded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.lock:
+            rows = [(self.run_id, self.scraper, recorded_at, name, json.dumps(dict(labels)), timing.count,
+                     timing.sum, *(timing.quantile(q) for q in QUANTILES), timing.max)
+                    for (name, labels), timing in sorted(self.timings.items())]
+            rows += [(self.run_id, self.scraper, recorded_at, name, json.dumps(dict(labels)), n,
+                      None, None, None, None, None)
+                     for (name, labels), n in sorted(self.counters.items())]
+        return rows
+
+    def prometheus(self) -> str:
+        def series(name, labels, **extra):
+            pairs = [*self.labels.items(), *labels, *extra.items()]
+            label_text = ",".join(f'{key}="{escape(value)}"' for key, value in pairs)
+            return f"{name}{{{label_text}}}" if label_text else name
+
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in [*self.timings, *self.counters]}):
+                timed = name in {metric for metric, _ in self.timings}
+                lines += [f"# HELP {name} {METRICS.get(name, name)}", f"# TYPE {name} {'summary' if timed else 'counter'}"]
+                if timed:
+                    for (metric, labels), timing in sorted(self.timings.items()):
+                        if metric == name:
+                            lines += [f"{series(name, labels, quantile=q)} {timing.quantile(q):.6g}" for q in QUANTILES]
+                            lines += [f"{series(name + '_sum', labels)} {timing.sum:.6g}",
+                                      f"{series(name + '_count', labels)} {timing.count}"]
+                else:
+                    lines += [f"{series(name, labels)} {n}" for (metric, labels), n in sorted(self.counters.items())
+                              if metric == name]
+        lines += ["# HELP scrape_run_seconds seconds since this scraper run started",
+                  "# TYPE scrape_run_seconds gauge",
+                  f"{series('scrape_run_seconds', ())} {time.monotonic() - self.started:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.executemany(INSERT_METRIC, self.metric_rows())
+        if self.metrics_file:
+            # write then rename, so a scrape of the file never sees half of it
+            os.makedirs(os.path.dirname(self.metrics_file) or ".", exist_ok=True)
+            tmp = f"{self.metrics_file}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.prometheus())
+            os.replace(tmp, self.metrics_file)
+
+    def flush_loop(self, every: float):
+        while not self.stop.wait(every):
+            self.flush()
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        hours = max(elapsed, 1e-9) / 3600
+
+        def seconds(value):
+            if value < 0.001:
+                return f"{value * 1e6:.0f}µs"
+            return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+        def series(name, labels):
+            return " ".join([name, *(f"{key}={value}" for key, value in labels)])
+
+        lines = [f"Telemetry ({self.scraper} run {self.run_id}, {elapsed:.0f}s):"]
+        with self.lock:
+            for (name, labels), timing in sorted(self.timings.items()):
+                quantiles = " ".join(f"p{q * 100:g} {seconds(timing.quantile(q))}" for q in QUANTILES)
+                lines.append(f"  {series(name, labels)}: {timing.count} "
+                             f"({timing.count / hours:.0f}/h) {quantiles} max {seconds(timing.max)}")
+            for (name, labels), n in sorted(self.counters.items()):
+                lines.append(f"  {series(name, labels)}: {n} ({n / hours:.0f}/h)")
+            fetches = sum(t.count for (name, _), t in self.timings.items() if name == "scrape_fetch_seconds")
+
+        if fetches:
+            lines.append(f"  retry rate: {self.total('scrape_fetch_failures_total') / fetches:.1%} of fetches failed")
+        return "\n".join(lines)
+
+    def close(self):
+        self.stop.set()
+        self.flush()
+        print(self.summary())
+
+
+_telemetry = None
+
+
+def start_telemetry(scraper: str, writer=None, metrics_file=None, **kwargs) -> Telemetry:
+    """Start recording a run, e.g. start_telemetry("race", get_writer(), "metrics/scraper-race.prom")."""
+    global _telemetry
+    if _telemetry is not None:
+        _telemetry.close()
+
+    labels = {}
+    if multiprocessing.parent_process() is not None:
+        # a shard worker (leases.run_sharded): a file of its own, or the workers overwrite each other
+        labels["worker"] = os.getpid()
+        if metrics_file:
+            root, ext = os.path.splitext(metrics_file)
+            metrics_file = f"{root}-{os.getpid()}{ext}"
+
+    _telemetry = Telemetry(scraper, writer, metrics_file, labels=labels, **kwargs)
+    return _telemetry
+
+
+def get_telemetry() -> Telemetry:
+    # without start_telemetry (parse workers, notebooks) this only keeps numbers in memory
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = Telemetry()
+    return _telemetry
+
+
+def stop_telemetry():
+    """Final flush and the end-of-run summary."""
+    global _telemetry
+    if _telemetry is not None:
+        _telemetry.close()
+        _telemetry = None
+
+
+def reset_in_child():
+    # a forked parse / shard worker starts empty; its parent's numbers (and flush thread) aren't its own
+    global _telemetry
+    _telemetry = None
+
+
+os.register_at_fork(after_in_child=reset_in_child)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Time the block into `name`. Yields the labels, so the block can fill
+    one in once it is known (e.g. the response status)."""
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        get_telemetry().observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(fn, name: str, **labels):
+    # fn, timed into `name` on every call
+    def call(*args, **kwargs):
+        with timer(name, **labels):
+            return fn(*args, **kwargs)
+    return call
+
+
+def count(name: str, n=1, **labels):
+    get_telemetry().count(name, n, **labels)
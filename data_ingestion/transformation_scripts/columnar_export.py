@@ -0,0 +1,158 @@
+import argparse
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from horse_results_preprocesser import process_chunk
+from meetings_preprocesser import transform_meetings
+from races_preprocesser import transform_races
+
+
+RAW_DB = "../raw_racing_data.db"
+PARQUET_ROOT = "../processed_parquet"
+
+TABLES = ("meetings", "races", "horse_results")
+
+
+def arrow_type(series: pd.Series) -> pa.DataType:
+    # one type per column whatever the chunk holds, so every file in the dataset shares a schema
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return pa.bool_()
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(dtype):
+        return pa.from_numpy_dtype(dtype.numpy_dtype)    # Int16 / Int64 stay narrow and nullable
+    if dtype == "uint8":
+        return pa.uint8()
+    if pd.api.types.is_numeric_dtype(dtype):
+        # int64 in one chunk turns float64 in the next as soon as a value is missing
+        return pa.float64()
+    # strings repeat a lot (names, codes, conditions): stored once per file, rows hold indexes
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    schema = pa.schema([(col, arrow_type(df[col])) for col in df.columns])
+    columns = []
+    for field in schema:
+        values = df[field.name]
+        if pa.types.is_dictionary(field.type):
+            columns.append(pa.array(values.astype("string"), from_pandas=True).dictionary_encode())
+        else:
+            columns.append(pa.array(values, from_pandas=True).cast(field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def with_partitions(df: pd.DataFrame, date_col: str) -> pd.DataFrame:
+    dates = pd.to_datetime(df[date_col], errors="coerce")
+    return df.assign(year=dates.dt.year.astype("Int16"), month=dates.dt.month.astype("Int16"))
+
+
+def months_between(raw_conn, start_date: str, end_date: str) -> list[tuple[int, int]]:
+    rows = raw_conn.execute("""
+        SELECT DISTINCT substr(date_utc, 1, 4), substr(date_utc, 6, 2) FROM meetings
+        WHERE date_utc BETWEEN ? AND ?
+    """, (start_date, end_date)).fetchall()
+    return [(int(year), int(month)) for year, month in rows]
+
+
+def clear_partitions(root: str, table: str, months):
+    # a month that is exported again replaces its partition; every other month is left alone
+    for year, month in months:
+        path = os.path.join(root, table, f"year={year}", f"month={month}")
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def write_partitions(df: pd.DataFrame, root: str, table: str, part: str):
+    if df.empty:
+        return
+    pq.write_to_dataset(
+        to_arrow(df),
+        os.path.join(root, table),
+        partition_cols=["year", "month"],
+        basename_template=f"part-{part}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        compression="zstd",
+    )
+
+
+def export(raw_conn, root=PARQUET_ROOT, start_date="0000-01-01", end_date="9999-12-31", chunk_size=25000):
+    """Write the transformed tables for [start_date, end_date] as parquet under
+    root/<table>/year=YYYY/month=M/, replacing only the months in that range."""
+    # whole months only, since a month's partition is replaced as a unit
+    start_date, end_date = start_date[:7] + "-01", end_date[:7] + "-31"
+    months = months_between(raw_conn, start_date, end_date)
+    for table in TABLES:
+        clear_partitions(root, table, months)
+
+    meetings = transform_meetings(raw_conn)
+    meetings = meetings[meetings["date_utc"].between(start_date, end_date)]
+    write_partitions(with_partitions(meetings, "date_utc"), root, "meetings", "0")
+    print(f"Exported {len(meetings)} meetings")
+
+    races = transform_races(raw_conn)
+    races = races.merge(meetings[["meeting_id", "date_utc"]], on="meeting_id", how="inner")
+    write_partitions(with_partitions(races, "date_utc"), root, "races", "0")
+    print(f"Exported {len(races)} races")
+
+    # in date order, so each chunk only touches a month or two
+    query = """
+        SELECT horse_results.*, meetings.date_utc FROM horse_results
+        JOIN meetings ON horse_results.meeting_id = meetings.meeting_id
+        WHERE meetings.date_utc BETWEEN ? AND ?
+        ORDER BY meetings.date_utc
+    """
+    runners = 0
+    for i, chunk in enumerate(pd.read_sql(query, raw_conn, params=(start_date, end_date), chunksize=chunk_size)):
+        print(f"Processing chunk {i+1} ({len(chunk)} rows)...")
+        write_partitions(with_partitions(process_chunk(chunk), "date_utc"), root, "horse_results", str(i))
+        runners += len(chunk)
+    print(f"Exported {runners} horse results over {len(months)} months")
+
+
+def load(table: str, columns=None, start_date=None, end_date=None, root=PARQUET_ROOT) -> pd.DataFrame:
+    """Read some columns of an exported table, optionally for a date range.
+
+    Only the partitions in range are opened, and files are memory-mapped.
+    """
+    dataset = ds.dataset(
+        os.path.join(root, table),
+        format="parquet",
+        partitioning="hive",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+    condition = None
+    for date, keep in ((start_date, lambda a, b: a >= b), (end_date, lambda a, b: a <= b)):
+        if date is None:
+            continue
+        year, month = int(date[:4]), int(date[5:7])
+        # prune whole months on the partition keys, then rows on the date itself
+        in_range = (
+            keep(ds.field("year"), year)
+            & ((ds.field("year") != year) | keep(ds.field("month"), month))
+            & keep(ds.field("date_utc"), date)
+        )
+        condition = in_range if condition is None else condition & in_range
+
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the transformed tables as year/month partitioned parquet")
+    parser.add_argument("--raw", default=RAW_DB, help="raw scraper database")
+    parser.add_argument("--out", default=PARQUET_ROOT, help="dataset root directory")
+    parser.add_argument("--start", default="0000-01-01", help="first date to (re)export (YYYY-MM-DD)")
+    parser.add_argument("--end", default="9999-12-31", help="last date to (re)export (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=25000, help="horse_results rows per chunk")
+    args = parser.parse_args()
+
+    raw_conn = sqlite3.connect(args.raw)
+    export(raw_conn, args.out, args.start, args.end, args.chunk_size)
+    raw_conn.close()
@@ -0,0 +1,332 @@
+import argparse
+import json
+import sqlite3
+
+import pandas as pd
+
+from processed_db import CREATE_FEATURE_CHANGES, FEATURE_TABLES, PROCESSED_DB
+
+
+# entity -> its key on runners; features and running state are kept for each
+ENTITIES = {"horse": "horse_id", "jockey": "jockey_id", "trainer": "trainer_id"}
+
+STATE_COLS = ["runs", "wins", "places", "margin_sum", "margin_runs"]
+FEATURES = ["runs", "win_rate", "place_rate", "avg_margin", "days_since"]
+
+# running totals per entity over every race featured so far: the store's only history
+CREATE_ENTITY_STATE = """
+CREATE TABLE IF NOT EXISTS entity_state (
+    entity TEXT,
+    entity_id INTEGER,
+    runs INTEGER,
+    wins INTEGER,
+    places INTEGER,
+    margin_sum REAL,
+    margin_runs INTEGER,
+    last_start TEXT,
+    PRIMARY KEY (entity, entity_id)
+)
+"""
+
+# one row per runner, each stat taken strictly before the race's start
+CREATE_RUNNER_FEATURES = f"""
+CREATE TABLE IF NOT EXISTS runner_features (
+    race_id INTEGER REFERENCES races (race_id),
+    running_number INTEGER,
+    is_emergency_runner INTEGER,
+    {", ".join(f"{entity}_runs INTEGER, {entity}_win_rate REAL, {entity}_place_rate REAL, "
+               f"{entity}_avg_margin REAL, {entity}_days_since REAL" for entity in ENTITIES)},
+    PRIMARY KEY (race_id, running_number, is_emergency_runner)
+)
+"""
+
+# races already folded into entity_state; the latest start is the watermark
+CREATE_FEATURE_RACES = """
+CREATE TABLE IF NOT EXISTS feature_races (
+    race_id INTEGER PRIMARY KEY,
+    start TEXT
+)
+"""
+
+# a race starts at its start_time, or at its meeting's date when that is missing
+RACE_START = "coalesce(races.start_time, meetings.date)"
+
+
+def create_schema(conn):
+    for sql in [CREATE_ENTITY_STATE, CREATE_RUNNER_FEATURES, CREATE_FEATURE_RACES, CREATE_FEATURE_CHANGES,
+                "CREATE INDEX IF NOT EXISTS idx_feature_races_start ON feature_races (start)"]:
+        conn.execute(sql)
+    conn.commit()
+
+
+def to_time(values) -> pd.Series:
+    return pd.to_datetime(pd.Series(values, dtype=object), utc=True, format="ISO8601")
+
+
+def new_races(conn):
+    """(race_id, start) of races not featured yet, in start order, and the
+    watermark.
+
+    A race without runners yet (a card scraped before its results) is left
+    for a later run, so it can't move the watermark past results still to come.
+    """
+    watermark = conn.execute("SELECT max(start) FROM feature_races").fetchone()[0]
+    races = pd.read_sql(f"""
+        SELECT races.race_id, {RACE_START} AS start FROM races
+        JOIN meetings ON races.meeting_id = meetings.meeting_id
+        WHERE NOT EXISTS (SELECT 1 FROM feature_races WHERE feature_races.race_id = races.race_id)
+          AND EXISTS (SELECT 1 FROM runners WHERE runners.race_id = races.race_id)
+          AND {RACE_START} IS NOT NULL
+        ORDER BY start, races.race_id
+    """, conn)
+    return races, watermark
+
+
+def as_json(ids) -> str:
+    return json.dumps([int(i) for i in ids])
+
+
+def read_runners(conn, race_ids) -> pd.DataFrame:
+    return query_runners(conn, "runners.race_id IN (SELECT value FROM json_each(?))", (as_json(race_ids),))
+
+
+def query_runners(conn, where: str, params: tuple) -> pd.DataFrame:
+    runners = pd.read_sql(f"""
+        SELECT runners.race_id, running_number, is_emergency_runner, horse_id, jockey_id, trainer_id,
+               finish_position, margin, place_winners, is_abandoned, {RACE_START} AS start
+        FROM runners
+        JOIN races ON runners.race_id = races.race_id
+        JOIN meetings ON races.meeting_id = meetings.meeting_id
+        WHERE {where}
+    """, conn, params=params)
+
+    # a run is a finish in a race that was actually run; scratchings and abandonments don't count
+    ran = runners["finish_position"].notna() & (runners["is_abandoned"].fillna(0) == 0)
+    return runners.assign(
+        start=to_time(runners["start"]),
+        ran=ran,
+        win=ran & (runners["finish_position"] == 1),
+        place=ran & (runners["finish_position"] <= runners["place_winners"].fillna(3)),
+        margin=runners["margin"].where(ran),
+    )
+
+
+def read_state(conn, entity: str, ids) -> pd.DataFrame:
+    state = pd.read_sql("""
+        SELECT * FROM entity_state WHERE entity = ? AND entity_id IN (SELECT value FROM json_each(?))
+    """, conn, params=(entity, as_json(ids)))
+    state = state.set_index("entity_id").astype({col: "float64" for col in STATE_COLS})
+    return state.assign(last_start=to_time(state["last_start"]).set_axis(state.index))
+
+
+def rolling_features(runners: pd.DataFrame, key: str, state: pd.DataFrame):
+    """Point-in-time stats for one entity kind over a batch of runners.
+
+    Returns (features, new_state): features per (entity, start) from everything
+    strictly before that start, prior batches included through `state`; and
+    the entity's running totals once the whole batch is counted.
+    """
+    rows = runners[runners[key].notna()].astype({key: "int64"})
+    per_start = rows.assign(margin_runs=rows["margin"].notna(), margin=rows["margin"].fillna(0)).groupby(
+        [key, "start"], sort=True
+    ).agg(runs=("ran", "sum"), wins=("win", "sum"), places=("place", "sum"),
+          margin_sum=("margin", "sum"), margin_runs=("margin_runs", "sum"))
+
+    entity_ids = per_start.index.get_level_values(0)
+    starts = per_start.index.get_level_values(1)
+    prior = state.reindex(entity_ids)
+
+    # totals before each start: earlier starts in this batch plus everything before it
+    before = per_start.groupby(level=0).cumsum() - per_start + prior[STATE_COLS].fillna(0).to_numpy()
+
+    # latest start the entity ran at, again strictly before
+    ran_at = pd.Series(starts, index=per_start.index).where(per_start["runs"] > 0)
+    last_start = ran_at.groupby(level=0).shift(1).groupby(level=0).ffill()
+    last_start = last_start.fillna(prior["last_start"].set_axis(per_start.index))
+
+    runs = before["runs"]
+    features = pd.DataFrame({
+        "runs": runs.astype("Int64"),
+        "win_rate": before["wins"] / runs.where(runs > 0),
+        "place_rate": before["places"] / runs.where(runs > 0),
+        "avg_margin": before["margin_sum"] / before["margin_runs"].where(before["margin_runs"] > 0),
+        "days_since": (pd.Series(starts, index=per_start.index) - last_start) / pd.Timedelta(days=1),
+    })
+
+    new_state = per_start.groupby(level=0).sum() + state.reindex(per_start.index.unique(0))[STATE_COLS].fillna(0)
+    new_state["last_start"] = ran_at.groupby(level=0).max().fillna(state["last_start"].reindex(new_state.index))
+    return features, new_state
+
+
+def save_state(conn, entity: str, state: pd.DataFrame):
+    rows = [
+        (entity, int(entity_id), int(s.runs), int(s.wins), int(s.places), float(s.margin_sum), int(s.margin_runs),
+         None if pd.isna(s.last_start) else s.last_start.isoformat())
+        for entity_id, s in zip(state.index, state.itertuples())
+    ]
+    conn.executemany("""
+        INSERT INTO entity_state (entity, entity_id, runs, wins, places, margin_sum, margin_runs, last_start)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (entity, entity_id) DO UPDATE SET
+            runs = excluded.runs, wins = excluded.wins, places = excluded.places,
+            margin_sum = excluded.margin_sum, margin_runs = excluded.margin_runs, last_start = excluded.last_start
+    """, rows)
+
+
+def sql_rows(frame: pd.DataFrame):
+    # NaN / NA -> NULL, numpy scalars -> python ones
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False)
+
+
+def roll_back(conn, late: pd.DataFrame):
+    """Refeature the history that late races (starting at or before the
+    watermark) and races reloaded by processed_db.py change, for only the
+    horses, jockeys and trainers that ran in them.
+
+    Each of those entities' state goes back to its featured runs before the
+    earliest changed start, and its columns of runner_features from that start
+    on are recomputed with the late races folded in. Everyone else's history
+    is left as it is. One transaction.
+    """
+    changes = pd.read_sql("SELECT * FROM feature_changes", conn)
+    since = min([*late["start"], *changes["start"].dropna()])
+    late_runners = read_runners(conn, late["race_id"])
+    table = late_runners[["race_id", "running_number", "is_emergency_runner"]].copy()
+    updates = []
+
+    for entity, key in ENTITIES.items():
+        ids = sorted({int(i) for runs in [late_runners, changes] for i in runs[key].dropna()})
+        featured = f"""runners.{key} IN (SELECT value FROM json_each(?))
+                       AND runners.race_id IN (SELECT race_id FROM feature_races WHERE start {{}} ?)"""
+
+        # running totals as they stood just before `since`
+        state = read_state(conn, entity, [])
+        history = query_runners(conn, featured.format("<"), (as_json(ids), since))
+        if not history.empty:
+            state = rolling_features(history, key, state)[1]
+
+        # their featured runs from `since` on, and the late races, folded in again in start order
+        replay = query_runners(conn, f"({featured.format('>=')}) OR runners.race_id IN (SELECT value FROM json_each(?))",
+                               (as_json(ids), since, as_json(late["race_id"])))
+        columns = [f"{entity}_{feature}" for feature in FEATURES]
+        if replay[key].notna().any():
+            features, new_state = rolling_features(replay, key, state)
+            joined = replay[[key, "start"]].astype({key: "Int64"}).join(features, on=[key, "start"])
+            replay[columns] = joined[FEATURES].to_numpy()
+            earlier_only = state.drop(new_state.index, errors="ignore")
+            state = pd.concat([earlier_only, new_state]) if not earlier_only.empty else new_state
+        else:
+            replay[columns] = None
+
+        is_late = replay["race_id"].isin(late["race_id"])
+        table = table.merge(replay.loc[is_late, ["race_id", "running_number", "is_emergency_runner", *columns]],
+                            on=["race_id", "running_number", "is_emergency_runner"], how="left")
+        updates.append((columns, replay.loc[~is_late, [*columns, "race_id", "running_number", "is_emergency_runner"]]))
+
+        # entities left with no featured runs at all drop out
+        conn.execute("DELETE FROM entity_state WHERE entity = ? AND entity_id IN (SELECT value FROM json_each(?))",
+                     (entity, as_json(ids)))
+        save_state(conn, entity, state)
+
+    for columns, rows in updates:
+        conn.executemany(f"""
+            UPDATE runner_features SET {", ".join(f"{col} = ?" for col in columns)}
+            WHERE race_id = ? AND running_number = ? AND is_emergency_runner = ?
+        """, sql_rows(rows))
+    # the reloaded races' old runners; their new versions are late races or come in with the next batches
+    conn.execute("DELETE FROM runner_features WHERE race_id IN (SELECT race_id FROM feature_changes)")
+    conn.executemany(f"INSERT INTO runner_features ({', '.join(table.columns)}) VALUES ({', '.join('?' * len(table.columns))})",
+                     sql_rows(table))
+    conn.executemany("INSERT INTO feature_races (race_id, start) VALUES (?, ?)",
+                     late[["race_id", "start"]].itertuples(index=False))
+    conn.execute("DELETE FROM feature_changes")
+    conn.commit()
+    return since, len(table), sum(len(rows) for _, rows in updates)
+
+
+def feature_batch(conn, races: pd.DataFrame):
+    # one transaction per batch: features, state and watermark move together
+    runners = read_runners(conn, races["race_id"])
+    table = runners[["race_id", "running_number", "is_emergency_runner"]].copy()
+
+    for entity, key in ENTITIES.items():
+        state = read_state(conn, entity, runners[key].dropna().unique())
+        features, new_state = rolling_features(runners, key, state)
+        joined = runners[[key, "start"]].astype({key: "Int64"}).join(features, on=[key, "start"])
+        for feature in FEATURES:
+            table[f"{entity}_{feature}"] = joined[feature]
+        save_state(conn, entity, new_state)
+
+    table.to_sql("runner_features", conn, if_exists="append", index=False)
+    conn.executemany("INSERT INTO feature_races (race_id, start) VALUES (?, ?)",
+                     races[["race_id", "start"]].itertuples(index=False))
+    conn.commit()
+    return len(table)
+
+
+def batches(races: pd.DataFrame, batch_races: int):
+    # cut only between distinct starts, so races starting together never see each other
+    first = 0
+    while first < len(races):
+        last_start = races["start"].iloc[min(first + batch_races, len(races)) - 1]
+        end = races["start"].searchsorted(last_start, side="right")
+        yield races.iloc[first:end]
+        first = end
+
+
+def update_feature_store(conn, batch_races: int = 5000, rebuild=False):
+    """Fold races not featured yet into the running state, in start order,
+    writing each runner's features as they stood before its race.
+
+    Races normally arrive after the watermark. One that starts at or before
+    it (a late scrape), or a featured race processed_db.py has reloaded,
+    changes history already used: that is rolled back and redone first, for
+    the entities that ran in those races only (roll_back).
+    """
+    create_schema(conn)
+    races, watermark = new_races(conn)
+    late = races[races["start"] <= watermark] if watermark is not None else races.iloc[:0]
+    # features for a late race that processed_db.py dropped without noting who ran in it (before
+    # feature_changes existed): its old runs can't be taken back out of entity_state
+    untracked = conn.execute("""
+        SELECT count(*) FROM runner_features WHERE race_id IN (SELECT value FROM json_each(?))
+          AND race_id NOT IN (SELECT race_id FROM feature_changes)
+    """, (as_json(late["race_id"]),)).fetchone()[0]
+    if untracked and not rebuild:
+        print("Reloaded races with no feature_changes record, rebuilding the feature store")
+        rebuild = True
+    if rebuild:
+        for table in FEATURE_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+        races, watermark = new_races(conn)
+        late = races.iloc[:0]
+
+    changed = conn.execute("SELECT count(DISTINCT race_id) FROM feature_changes").fetchone()[0]
+    if not late.empty or changed:
+        since, added, refeatured = roll_back(conn, late)
+        print(f"{len(late)} late and {changed} reloaded races: rolled back to {since}, "
+              f"{added} runners added, {refeatured} refeatured")
+        races = races[~races["race_id"].isin(late["race_id"])]
+
+    if races.empty:
+        print("Feature store up to date")
+        return
+
+    runners = 0
+    for i, batch in enumerate(batches(races, batch_races)):
+        runners += feature_batch(conn, batch)
+        print(f"Batch {i+1}: races up to {batch['start'].iloc[-1]}, {runners} runners")
+    print(f"Featured {len(races)} races, {runners} runners")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the point-in-time horse / jockey / trainer feature store")
+    parser.add_argument("--db", default=PROCESSED_DB, help="processed database (see processed_db.py)")
+    parser.add_argument("--batch-races", type=int, default=5000, help="races folded in per transaction")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the store from the first race")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    update_feature_store(conn, args.batch_races, args.rebuild)
+    conn.close()
@@ -1,7 +1,13 @@
+import argparse
 import sqlite3
+import json
+import os
+import resource
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import re
 
 pd.set_option('display.max_rows', 500)
 
@@ -72,6 +78,102 @@ CREATE TABLE IF NOT EXISTS horse_results (
 """
 
 
+# record-style fields like "2: 0-0-0", split into *_starts, *_wins, *_seconds, *_thirds
+RECORD_COLS = [
+    "career", "jh", "twelve_month", "season", "track", "distance", "track_dist",
+    "firm", "good", "soft", "heavy", "wet", "first_up", "second_up", "third_up",
+    "class", "group1", "group2", "group3", "listed", "clockwise", "a_clockwise",
+    "night", "synthetic", "as_fav"
+]
+RECORD_PARTS = ("starts", "wins", "seconds", "thirds")
+RECORD_RE = r'^\s*(\d+)\s*:\s*(\d+)\s*-\s*(\d+)\s*-\s*(\d+)\s*$'
+
+# lowercased text columns holding the same few thousand names over and over, emitted as categoricals
+CATEGORY_COLS = ["name", "sex", "trainer", "jockey", "sire", "dam"]
+
+# last_10 form characters -> finishing position: '1'..'9', '0' = 10th or worse, 'F'/'L' (DNF / lost rider) = 11.
+# 'X' marks a spell (-1); anything else, and the padding, is 0
+LAST10_CODES = np.zeros(256, dtype=np.int8)
+LAST10_CODES[np.frombuffer(b"123456789", dtype=np.uint8)] = np.arange(1, 10)
+LAST10_CODES[ord("0")] = 10
+LAST10_CODES[[ord("F"), ord("L")]] = 11
+LAST10_CODES[ord("X")] = -1
+
+
+def last10_features(last_10: pd.Series) -> pd.DataFrame:
+    """Recency-weighted average, last, best, top-5 count and runs since the
+    last spell from last_10 form strings, e.g. "x2F10x3".
+
+    The strings are decoded into one row of position codes per runner and
+    everything is computed on that matrix. A runner with no runs gets 0s.
+    """
+    form = last_10.where(last_10.notna(), "").astype(str).str.upper().str.strip()
+    form = form.str.replace(r"[^0-9XFL]", "", regex=True)  # keep only valid chars
+
+    width = max(int(form.str.len().max()) if len(form) else 0, 1)
+    raw = np.array(form.tolist(), dtype=f"S{width}").view(np.uint8).reshape(len(form), width)
+    codes = LAST10_CODES[raw].astype(np.int64)
+
+    is_run = codes > 0
+    order = np.cumsum(is_run, axis=1)       # 1..n along each row's runs = recency weight
+    n = order[:, -1]
+    has_runs = n > 0
+    rows = np.arange(len(form))
+
+    # weights 1..n sum to n(n+1)/2; both sums are exact, so this is np.average's result to the bit
+    weighted = np.where(is_run, codes * order, 0).sum(axis=1).astype(float)
+    wavg = np.divide(weighted, n * (n + 1) / 2, out=np.zeros(len(form)), where=has_runs)
+
+    last = codes[rows, width - 1 - np.argmax(is_run[:, ::-1], axis=1)]
+    best = np.where(is_run, codes, 127).min(axis=1)
+    top5 = (is_run & (codes <= 5)).sum(axis=1)
+
+    # runs since last spell = race symbols after the last 'X'
+    is_spell = codes == -1
+    last_x = width - 1 - np.argmax(is_spell[:, ::-1], axis=1)
+    since = np.where(is_spell.any(axis=1), n - order[rows, last_x], n)
+
+    return pd.DataFrame({
+        # rows without runs are int 0s, so the column is only float once some row has a run
+        "last10_wavg_pos": wavg if has_runs.any() else wavg.astype(np.int64),
+        "last10_last_pos": pd.array(np.where(has_runs, last, 0), dtype="Int16"),
+        "last10_best_pos": pd.array(np.where(has_runs, best, 0), dtype="Int16"),
+        "last10_top5": pd.array(top5, dtype="Int16"),
+        "last10_runs_since_spell": pd.array(since, dtype="Int16"),
+    }, index=last_10.index)
+
+
+def parse_records(df: pd.DataFrame) -> np.ndarray:
+    """All RECORD_COLS of a raw chunk as one C-contiguous int16 array of shape
+    (rows, len(RECORD_COLS), 4): starts, wins, seconds, thirds. Anything that
+    isn't a "N: W-S-T" record is 0s.
+
+    The 25 columns are parsed together, one regex match per distinct record
+    string. Modelling code can use the array as is, without going through
+    the *_starts ... *_thirds columns: process_chunk(..., return_block=True)
+    and transform_horse_results(..., with_blocks=True) hand it over from the
+    same parse.
+    """
+    values = df[RECORD_COLS].to_numpy(dtype=object).ravel()       # row by row, the 25 fields of each
+    codes, uniques = pd.factorize(values)
+
+    parts = pd.Series(uniques, dtype=object).astype(str).str.strip().str.extract(RECORD_RE)
+    table = parts.apply(pd.to_numeric, errors="coerce").fillna(0).astype("Int16").to_numpy(np.int16)
+    table = np.vstack([table, np.zeros((1, len(RECORD_PARTS)), dtype=np.int16)])     # code -1 (missing) -> 0s
+
+    return table[codes].reshape(len(df), len(RECORD_COLS), len(RECORD_PARTS))
+
+
+def record_block(df: pd.DataFrame) -> np.ndarray:
+    """The (rows, 25, 4) int16 record block back out of process_chunk's output columns,
+    for frames that were stored without it (a copy; see parse_records)."""
+    block = np.empty((len(df), len(RECORD_COLS), len(RECORD_PARTS)), dtype=np.int16)
+    for i, col in enumerate(RECORD_COLS):
+        for j, part in enumerate(RECORD_PARTS):
+            block[:, i, j] = df[f"{col}_{part}"].to_numpy(dtype=np.int16)
+    return block
+
+
 def extract_running_number(running_number):
    """Extract numeric running number, handling emergency runners."""
    running_str = str(running_number).strip().lower()
@@ -86,8 +188,10 @@ def extract_running_number(running_number):
        return None
 
 
-def process_chunk(df: pd.DataFrame) -> pd.DataFrame:
-    
+def process_chunk(df: pd.DataFrame, vocab: dict = None, return_block=False):
+    """Transform one raw horse_results chunk. With return_block=True returns
+    (frame, block), block being the parse_records array the record columns
+    were made from, row for row."""
     df = df.replace("", None)
 
     # finish_position
@@ -175,78 +279,17 @@ def process_chunk(df: pd.DataFrame) -> pd.DataFrame:
     # "class", "group1", "group2", "group3", "listed", "clockwise", "a_clockwise",
     # "night", "synthetic", "as_fav"    
     # split record-style fields like "2: 0-0-0" -> *_starts, *_wins, *_seconds, *_thirds
-    record_cols = [
-        "career", "jh", "twelve_month", "season", "track", "distance", "track_dist",
-        "firm", "good", "soft", "heavy", "wet", "first_up", "second_up", "third_up",
-        "class", "group1", "group2", "group3", "listed", "clockwise", "a_clockwise",
-        "night", "synthetic", "as_fav"
-    ]
-
-    pattern = r'^\s*(?P<starts>\d+)\s*:\s*(?P<wins>\d+)\s*-\s*(?P<seconds>\d+)\s*-\s*(?P<thirds>\d+)\s*$'
-
-    for col in record_cols:
-        if col in df.columns:
-            parts = (
-                df[col]
-                .astype(str).str.strip()           # handles None/'-'/'' etc.
-                .str.extract(pattern)              # non-matches -> NaN
-            )
-
-            for k in ("starts", "wins", "seconds", "thirds"):
-                df[f"{col}_{k}"] = (
-                    pd.to_numeric(parts[k], errors="coerce")
-                    .fillna(0)
-                    .astype("Int16")
-                )
-
-    df.drop(columns=record_cols, inplace=True)      # drop original columns
+    # all 25 parsed together into one (rows, 25, 4) block (parse_records), then one Int16 column per part
+    block = parse_records(df)
+    records = pd.DataFrame({
+        f"{col}_{part}": pd.array(block[:, i, j], dtype="Int16")
+        for i, col in enumerate(RECORD_COLS)
+        for j, part in enumerate(RECORD_PARTS)
+    }, index=df.index)
+    df = pd.concat([df.drop(columns=RECORD_COLS), records], axis=1)      # drop original columns
     
     # last_10
-    def _map_pos(c):
-        if c == '0':  # 10th or worse
-            return 10
-        if c in 'FL':  # DNF / Lost rider
-            return 11
-        return int(c)   # '1'..'9'
-
-    def _last10_five(s):
-        s = '' if pd.isna(s) else str(s).upper().strip()
-        s = re.sub(r'[^0-9XFL]', '', s)  # keep only valid chars
-
-        runs = [c for c in s if c in '0123456789FL']
-
-        if runs:
-            pos = [_map_pos(c) for c in runs]
-            n = len(pos)
-            w = np.arange(1, n + 1, dtype=float)  # recency weights 1..n
-            out = {
-                'last10_wavg_pos': float(np.average(pos, weights=w)),
-                'last10_last_pos': pos[-1],
-                'last10_best_pos': min(pos),
-                'last10_top5': int(sum(p <= 5 for p in pos)),
-            }
-        else:
-            out = {
-                'last10_wavg_pos': 0,
-                'last10_last_pos': 0,
-                'last10_best_pos': 0,
-                'last10_top5': 0,
-            }
-
-        # runs since last spell = race symbols after last 'X'
-        last_x = s.rfind('X')
-        since = (len(runs) if last_x == -1
-                    else sum(c in '0123456789FL' for c in s[last_x+1:]))
-        out['last10_runs_since_spell'] = since
-        return pd.Series(out)
-
-    feats5 = df['last_10'].apply(_last10_five)
-
-    # tidy dtypes
-    feats5['last10_top5'] = feats5['last10_top5'].astype('Int16')
-    feats5['last10_runs_since_spell'] = feats5['last10_runs_since_spell'].astype('Int16')
-    feats5['last10_last_pos'] = feats5['last10_last_pos'].astype('Int16')
-    feats5['last10_best_pos'] = feats5['last10_best_pos'].astype('Int16')
+    feats5 = last10_features(df['last_10'])
 
     df = pd.concat([df, feats5], axis=1).drop(columns='last_10')
     
@@ -268,6 +311,11 @@ def process_chunk(df: pd.DataFrame) -> pd.DataFrame:
         df[c] = pd.to_numeric(s, errors='coerce') / 100.0
     
     print(df['win_percent'].value_counts())
+
+    # name, sex, trainer, jockey, sire, dam as categoricals. With a run-wide vocab (see category_vocab)
+    # every chunk has the same categories, so chunks concatenate without being re-encoded
+    for col in CATEGORY_COLS:
+        df[col] = df[col].astype(vocab[col] if vocab else "category")
     
 
 
@@ -279,31 +327,188 @@ def process_chunk(df: pd.DataFrame) -> pd.DataFrame:
     #print(df.columns)
     # print(df.head())
 
-    return df
+    return (df, block) if return_block else df
+
+
+def race_filter(race_ids=None):
+    # incremental runs: only these races
+    if race_ids is None:
+        return "1", ()
+    return "race_id IN (SELECT value FROM json_each(?))", (json.dumps(list(race_ids)),)
+
+
+def read_horse_results(raw_conn, chunk_size: int = 25000, race_ids=None):
+    """Raw horse_results in chunks, optionally only the runners of `race_ids`."""
+    where, params = race_filter(race_ids)
+    # rowid order, as process_parallel's slices are cut: a race_id filter may otherwise be read through an index
+    return pd.read_sql(f"SELECT * FROM horse_results WHERE {where} ORDER BY rowid", raw_conn, params=params,
+                       chunksize=chunk_size)
+
+
+def category_vocab(raw_conn, race_ids=None) -> dict:
+    """col -> CategoricalDtype of every value process_chunk can produce for
+    CATEGORY_COLS from the rows being transformed."""
+    where, params = race_filter(race_ids)
+    vocab = {}
+    for col in CATEGORY_COLS:
+        values = pd.read_sql(f"SELECT DISTINCT {col} FROM horse_results WHERE {where}", raw_conn, params=params)[col]
+        # same cleaning as process_chunk, so no value falls outside the categories
+        values = values.replace("", None).str.lower().dropna().unique()
+        vocab[col] = pd.CategoricalDtype(sorted(values))
+    return vocab
+
+
+def rowid_slices(raw_conn, chunk_size: int = 25000, race_ids=None) -> list[tuple[int, int]]:
+    # (first, last) rowids of consecutive chunk_size-row slices, the same rows read_horse_results chunks hold
+    where, params = race_filter(race_ids)
+    return raw_conn.execute(f"""
+        SELECT min(rowid), max(rowid) FROM (
+            SELECT rowid, (row_number() OVER (ORDER BY rowid) - 1) / ? AS slice
+            FROM horse_results WHERE {where}
+        )
+        GROUP BY slice ORDER BY slice
+    """, (chunk_size, *params)).fetchall()
+
+
+# set in each pool worker by its initializer rather than pickled with every chunk
+worker_vocab = None
+
+
+def set_worker_vocab(vocab: dict):
+    global worker_vocab
+    worker_vocab = vocab
+
+
+def process_slice(raw_path: str, first: int, last: int, race_ids=None, return_block=False):
+    # runs in a pool worker, which reads its own rows so the parent doesn't have to read and pickle them
+    where, params = race_filter(race_ids)
+    conn = sqlite3.connect(f"file:{raw_path}?mode=ro", uri=True)
+    try:
+        chunk = pd.read_sql(f"SELECT * FROM horse_results WHERE rowid BETWEEN ? AND ? AND {where}",
+                            conn, params=(first, last, *params))
+    finally:
+        conn.close()
+    return process_chunk(chunk, worker_vocab, return_block)
+
+
+def process_parallel(raw_conn, chunk_size: int = 25000, race_ids=None, workers=None, max_in_flight=None,
+                     vocab=None, return_block=False):
+    """process_chunk over horse_results on a pool of `workers` processes.
 
+    Yields the transformed chunks in rowid order, the same ones the serial
+    path produces. At most `max_in_flight` chunks (2 per worker by default)
+    are queued or waiting to be taken, which bounds memory when the consumer
+    is slower than the pool. With return_block, (chunk, block) pairs as
+    process_chunk returns them.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    raw_path = raw_conn.execute("PRAGMA database_list").fetchone()[2]
+    race_ids = None if race_ids is None else list(race_ids)
 
-def transform_horse_results(raw_conn, chunk_size: int = 25000) -> pd.DataFrame:
-    """Process horse results data in chunks."""
-    query = "SELECT * FROM horse_results"
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_vocab, initargs=(vocab,)) as pool:
+        pending = deque()
+        for first, last in rowid_slices(raw_conn, chunk_size, race_ids):
+            pending.append(pool.submit(process_slice, raw_path, first, last, race_ids, return_block))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # high-water resident set size of this process so far (RUSAGE_CHILDREN: its largest finished child)
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024    # bytes on macOS, KB on Linux
+
+
+def sqlite_sink(conn, table: str = "horse_results"):
+    """Sink that writes each transformed chunk to `table`, replacing it on the first chunk."""
+    first = True
+
+    def write(chunk: pd.DataFrame):
+        nonlocal first
+        chunk.to_sql(table, conn, if_exists="replace" if first else "append", index=False)
+        first = False
+
+    return write
+
+
+def transform_horse_results(raw_conn, chunk_size: int = 25000, race_ids=None, sink=None, workers=1,
+                            with_blocks=False):
+    """Process horse results data in chunks.
+
+    Without a sink the chunks are concatenated and returned as one DataFrame.
+    With one, each transformed chunk is handed to sink(chunk) as soon as it is
+    ready and dropped, so memory stays at about one chunk; the row count is returned.
+    workers > 1 runs process_chunk on that many processes (see process_parallel).
+
+    with_blocks=True also passes on each chunk's parse_records block, from the
+    same parse: sink(chunk, block), or (frame, block) returned without a sink.
+    """
     chunks = []
-    
-    for i, chunk in enumerate(pd.read_sql(query, raw_conn, chunksize=chunk_size)):
-        print(f"Processing chunk {i+1} ({len(chunk)} rows)...")
-        
+    blocks = []
+    rows = 0
+
+    # one vocabulary for the whole run
+    vocab = category_vocab(raw_conn, race_ids)
+
+    if workers > 1:
+        transformed = process_parallel(raw_conn, chunk_size, race_ids, workers, vocab=vocab, return_block=with_blocks)
+    else:
         # Apply transformation to chunk
-        transformed_chunk = process_chunk(chunk)
-        chunks.append(transformed_chunk)
+        transformed = (process_chunk(chunk, vocab, with_blocks)
+                       for chunk in read_horse_results(raw_conn, chunk_size, race_ids))
+    
+    for i, result in enumerate(transformed):
+        transformed_chunk, block = result if with_blocks else (result, None)
+        print(f"Processed chunk {i+1} ({len(transformed_chunk)} rows)...")
         
         # Optional: Memory monitoring
         print(f"Chunk memory: {transformed_chunk.memory_usage(deep=True).sum() / 1024**2:.1f} MB")
+
+        rows += len(transformed_chunk)
+        if sink is None:
+            chunks.append(transformed_chunk)
+            if with_blocks:
+                blocks.append(block)
+        elif with_blocks:
+            sink(transformed_chunk, block)
+        else:
+            sink(transformed_chunk)
+        # nothing left holding this chunk while the next one is read
+        del transformed_chunk, block
         
         #return      ## TEMPORARY RETURN
+
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB"
+          + (f", largest worker {peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB" if workers > 1 else ""))
+    if sink is not None:
+        return rows
     
     print("Combining all chunks...")
-    return pd.concat(chunks, ignore_index=True)
-
-
-
-
-raw_conn = sqlite3.connect('../raw_racing_data.db')
-transform_horse_results(raw_conn)
+    frame = pd.concat(chunks, ignore_index=True)
+    if with_blocks:
+        return frame, np.concatenate(blocks) if blocks else np.empty((0, len(RECORD_COLS), len(RECORD_PARTS)), np.int16)
+    return frame
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transform horse_results")
+    parser.add_argument("--raw", default="../raw_racing_data.db", help="raw scraper database")
+    parser.add_argument("--chunk-size", type=int, default=25000, help="horse_results rows per chunk")
+    parser.add_argument("--out", help="stream the transformed chunks into this sqlite db's horse_results table")
+    parser.add_argument("--workers", type=int, default=1, help="processes running process_chunk (0 = one per core)")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    raw_conn = sqlite3.connect(args.raw)
+    if args.out:
+        out_conn = sqlite3.connect(args.out)
+        rows = transform_horse_results(raw_conn, args.chunk_size, sink=sqlite_sink(out_conn), workers=workers)
+        out_conn.close()
+        print(f"Wrote {rows} rows to {args.out}")
+    else:
+        transform_horse_results(raw_conn, args.chunk_size, workers=workers)
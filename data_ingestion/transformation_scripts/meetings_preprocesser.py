@@ -1,8 +1,17 @@
+import json
+
 import pandas as pd
 
 
-def transform_meetings(raw_conn: pd.DataFrame) -> pd.DataFrame:
-    df = pd.read_sql("SELECT * FROM meetings", raw_conn)
+def transform_meetings(raw_conn: pd.DataFrame, meeting_ids=None) -> pd.DataFrame:
+    query = "SELECT * FROM meetings"
+    params = ()
+    if meeting_ids is not None:
+        # incremental runs: only these meetings
+        query += " WHERE meeting_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(meeting_ids)),)
+
+    df = pd.read_sql(query, raw_conn, params=params)
     df = df.replace("", None)
 
     # name
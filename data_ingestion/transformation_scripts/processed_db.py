@@ -0,0 +1,495 @@
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from horse_results_preprocesser import RECORD_COLS, RECORD_PARTS, transform_horse_results
+from meetings_preprocesser import transform_meetings
+from races_preprocesser import transform_races
+
+
+RAW_DB = "../raw_racing_data.db"
+PROCESSED_DB = "../processed_racing_data.db"
+
+# dimension table -> its integer surrogate key (horses are keyed on the raw identity instead, see Horses)
+DIMENSIONS = {
+    "jockeys": "jockey_id",
+    "trainers": "trainer_id",
+    "sires": "sire_id",
+    "dams": "dam_id",
+    "venues": "venue_id",
+}
+
+RUNNER_FLAGS = ["has_t", "has_d", "has_s", "has_h", "has_n", "has_b", "has_o", "has_HT", "has_G", "has_DA"]
+RUNNER_RECORDS = [f"{col}_{part}" for col in RECORD_COLS for part in RECORD_PARTS]
+RUNNER_LAST10 = ["last10_last_pos", "last10_best_pos", "last10_top5", "last10_runs_since_spell"]
+
+# one row per raw horse_identity hash (horse_identity.py), so runners.horse_id means the same as the raw
+# horse_results.horse_id and two horses of the same name stay apart
+CREATE_HORSES = """
+CREATE TABLE IF NOT EXISTS horses (
+    horse_id INTEGER PRIMARY KEY,
+    name TEXT
+)
+"""
+
+CREATE_VENUES = """
+CREATE TABLE IF NOT EXISTS venues (
+    venue_id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE,
+    state TEXT,
+    country TEXT,
+    address TEXT
+)
+"""
+
+CREATE_MEETINGS = """
+CREATE TABLE IF NOT EXISTS meetings (
+    meeting_id INTEGER PRIMARY KEY,
+    venue_id INTEGER REFERENCES venues (venue_id),
+    date TEXT,
+    time_group TEXT,
+    rail_position TEXT,
+    track_comments TEXT,
+    penetrometer REAL,
+    meeting_type TEXT,
+    meeting_category TEXT,
+    total_prize REAL
+)
+"""
+
+CREATE_RACES = """
+CREATE TABLE IF NOT EXISTS races (
+    race_id INTEGER PRIMARY KEY,
+    meeting_id INTEGER REFERENCES meetings (meeting_id),
+    event_number INTEGER,
+    name TEXT,
+    distance INTEGER,
+    event_class TEXT,
+    age_restriction TEXT,
+    sex_restriction TEXT,
+    race_type TEXT,
+    race_class TEXT,
+    group_type TEXT,
+    track_type TEXT,
+    start_time TEXT,
+    track_condition_overall TEXT,
+    track_condition_rating INTEGER,
+    track_rail_info TEXT,
+    is_abandoned INTEGER,
+    place_winners INTEGER,
+    total_prize REAL,
+    first_prize REAL,
+    second_prize REAL,
+    third_prize REAL,
+    winning_time REAL,
+    sectional_time REAL,
+    sectional_distance INTEGER
+)
+"""
+
+# one row per runner: the typed process_chunk columns, with names swapped for dimension keys
+# (horse_id is the raw horse identity).
+# Raw text process_chunk doesn't parse (flucs, sire stats, last race / win) stays in the raw db.
+CREATE_RUNNERS = f"""
+CREATE TABLE IF NOT EXISTS runners (
+    race_id INTEGER REFERENCES races (race_id),
+    running_number INTEGER,
+    is_emergency_runner INTEGER,
+    horse_id INTEGER REFERENCES horses (horse_id),
+    jockey_id INTEGER REFERENCES jockeys (jockey_id),
+    trainer_id INTEGER REFERENCES trainers (trainer_id),
+    sire_id INTEGER REFERENCES sires (sire_id),
+    dam_id INTEGER REFERENCES dams (dam_id),
+    finish_position INTEGER,
+    barrier INTEGER,
+    age INTEGER,
+    sex TEXT,
+    original_weight REAL,
+    adjusted_weight REAL,
+    pos_400 INTEGER,
+    pos_800 INTEGER,
+    margin REAL,
+    sp REAL,
+    rating REAL,
+    best_win REAL,
+    prize REAL,
+    avg_earn REAL,
+    win_percent REAL,
+    place_percent REAL,
+    tj_win_percent REAL,
+    roi REAL,
+    {", ".join(f"{col} INTEGER" for col in RUNNER_FLAGS)},
+    {", ".join(f"{col} INTEGER" for col in RUNNER_RECORDS)},
+    last10_wavg_pos REAL,
+    {", ".join(f"{col} INTEGER" for col in RUNNER_LAST10)},
+    PRIMARY KEY (race_id, running_number, is_emergency_runner)
+)
+"""
+
+# how far into the raw db's raw_changes log this db has been brought up to date
+CREATE_WATERMARKS = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    source TEXT PRIMARY KEY,
+    seq INTEGER,
+    updated_at TEXT
+)
+"""
+
+# derived from runners by feature_store.py; dropped on a full build
+FEATURE_TABLES = ["runner_features", "entity_state", "feature_races", "feature_changes"]
+
+# featured races an incremental run has reloaded: who ran in the version the feature store folded in,
+# and when, so feature_store.py can roll just those horses / jockeys / trainers back
+CREATE_FEATURE_CHANGES = """
+CREATE TABLE IF NOT EXISTS feature_changes (
+    race_id INTEGER,
+    start TEXT,
+    horse_id INTEGER,
+    jockey_id INTEGER,
+    trainer_id INTEGER
+)
+"""
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_horses_name ON horses (name)",               # racing_queries horse_form
+    "CREATE INDEX IF NOT EXISTS idx_meetings_venue ON meetings (venue_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_meetings_date ON meetings (date)",           # racing_queries race cards
+    "CREATE INDEX IF NOT EXISTS idx_races_meeting ON races (meeting_id)",
+    "CREATE INDEX IF NOT EXISTS idx_runners_horse ON runners (horse_id)",
+    "CREATE INDEX IF NOT EXISTS idx_runners_jockey ON runners (jockey_id)",
+    "CREATE INDEX IF NOT EXISTS idx_runners_trainer ON runners (trainer_id)",
+]
+
+
+def create_schema(conn):
+    for table, key in DIMENSIONS.items():
+        if table != "venues":
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key} INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+    for sql in [CREATE_HORSES, CREATE_VENUES, CREATE_MEETINGS, CREATE_RACES, CREATE_RUNNERS, CREATE_WATERMARKS, *INDEXES]:
+        conn.execute(sql)
+    conn.commit()
+
+
+class Dimension:
+    """name -> integer surrogate key for one dimension table.
+
+    Keys are handed out in order of first appearance and never change, so a
+    rebuild of the fact tables keeps every existing id.
+    """
+
+    def __init__(self, conn, table: str, key: str):
+        self.conn = conn
+        self.table = table
+        self.key = key
+        self.ids = dict(conn.execute(f"SELECT name, {key} FROM {table}"))
+
+    def keys(self, names: pd.Series, attributes: pd.DataFrame = None) -> pd.Series:
+        new = [name for name in pd.unique(names.dropna()) if name not in self.ids]
+
+        if new:
+            first_id = max(self.ids.values(), default=0) + 1
+            rows = pd.DataFrame({self.key: range(first_id, first_id + len(new)), "name": new})
+            if attributes is not None:
+                # extra columns are taken from the first row each name appears on
+                first_seen = attributes.assign(name=names).drop_duplicates("name")
+                rows = rows.merge(first_seen, on="name", how="left")
+
+            rows.to_sql(self.table, self.conn, if_exists="append", index=False)
+            self.ids.update(zip(rows["name"], rows[self.key]))
+
+        return names.map(self.ids).astype("Int64")
+
+
+class Horses:
+    """The horses dimension: raw horse identity -> the name it was first seen with.
+
+    No surrogate to hand out; new identities are just added, so the ids are
+    the same in every build and on every machine.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.ids = {horse_id for horse_id, in conn.execute("SELECT horse_id FROM horses")}
+
+    def keys(self, horse_ids: pd.Series, names: pd.Series) -> pd.Series:
+        horse_ids = as_int(horse_ids)
+        rows = pd.DataFrame({"horse_id": horse_ids, "name": names}).dropna(subset=["horse_id"])
+        new = rows[~rows["horse_id"].isin(self.ids)].drop_duplicates("horse_id")
+
+        if len(new):
+            new.to_sql("horses", self.conn, if_exists="append", index=False)
+            self.ids.update(new["horse_id"])
+
+        return horse_ids
+
+
+def dimensions(conn) -> dict:
+    return {"horses": Horses(conn), **{table: Dimension(conn, table, key) for table, key in DIMENSIONS.items()}}
+
+
+def name_keyed_horses(conn) -> bool:
+    # horses from before they were keyed on the raw identity: one surrogate id per name
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'horses'").fetchone()
+    return sql is not None and "UNIQUE" in sql[0]
+
+
+def as_int(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s, errors="coerce").astype("Int64")
+
+
+def as_float(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s, errors="coerce").astype("float64")
+
+
+def as_id(s: pd.Series) -> pd.Series:
+    # raw ids are numeric strings; anything else is a bug upstream, not a NULL
+    return pd.to_numeric(s).astype("Int64")
+
+
+def meetings_table(meetings: pd.DataFrame, dims: dict) -> pd.DataFrame:
+    return pd.DataFrame({
+        "meeting_id": as_id(meetings["meeting_id"]),
+        "venue_id": dims["venues"].keys(meetings["name"], meetings[["state", "country", "address"]]),
+        "date": meetings["date_utc"],
+        "time_group": meetings["time_group"],
+        "rail_position": meetings["rail_position"],
+        "track_comments": meetings["track_comments"],
+        "penetrometer": as_float(meetings["penetrometer"]),
+        "meeting_type": meetings["meeting_type"],
+        "meeting_category": meetings["meeting_category"],
+        "total_prize": as_float(meetings["meeting_total_prize"]),
+    })
+
+
+def races_table(races: pd.DataFrame) -> pd.DataFrame:
+    table = pd.DataFrame({
+        "race_id": as_id(races["race_id"]),
+        "meeting_id": as_id(races["meeting_id"]),
+        "event_number": as_int(races["event_number"]),
+        "distance": as_int(races["distance"]),
+        "track_condition_rating": as_int(races["track_condition_rating"]),
+        "is_abandoned": as_int(races["is_abandoned"]),
+        "place_winners": as_int(races["place_winners"]),
+        "sectional_distance": as_int(races["sectional_distance"]),
+    })
+    for col in ["name", "event_class", "age_restriction", "sex_restriction", "race_type", "race_class",
+                "group_type", "track_type", "start_time", "track_condition_overall", "track_rail_info"]:
+        table[col] = races[col]
+    for col in ["total_prize", "first_prize", "second_prize", "third_prize", "winning_time", "sectional_time"]:
+        table[col] = as_float(races[col])
+    return table
+
+
+def runners_table(chunk: pd.DataFrame, dims: dict) -> pd.DataFrame:
+    table = pd.DataFrame({
+        "race_id": as_id(chunk["race_id"]),
+        "running_number": as_int(chunk["running_number"]),
+        "is_emergency_runner": chunk["is_emergency_runner"].astype("int8"),
+        "horse_id": dims["horses"].keys(chunk["horse_id"], chunk["name"]),
+        "jockey_id": dims["jockeys"].keys(chunk["jockey"]),
+        "trainer_id": dims["trainers"].keys(chunk["trainer"]),
+        "sire_id": dims["sires"].keys(chunk["sire"]),
+        "dam_id": dims["dams"].keys(chunk["dam"]),
+        "sex": chunk["sex"],
+    })
+    for col in ["finish_position", "barrier", "age", "pos_400", "pos_800",
+                *RUNNER_FLAGS, *RUNNER_RECORDS, *RUNNER_LAST10]:
+        table[col] = as_int(chunk[col])
+    for col in ["original_weight", "adjusted_weight", "margin", "sp", "rating", "best_win", "prize", "avg_earn",
+                "win_percent", "place_percent", "tj_win_percent", "roi", "last10_wavg_pos"]:
+        table[col] = as_float(chunk[col])
+    return table
+
+
+def raw_seq(raw_conn):
+    # latest raw_changes seq, None when the raw db predates the log (migration 5)
+    try:
+        return raw_conn.execute("SELECT coalesce(max(seq), 0) FROM raw_changes").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def get_watermark(conn):
+    row = conn.execute("SELECT seq FROM watermarks WHERE source = 'raw_changes'").fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(conn, seq: int):
+    conn.execute("""
+        INSERT INTO watermarks (source, seq, updated_at) VALUES ('raw_changes', ?, ?)
+        ON CONFLICT (source) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at
+    """, (seq, datetime.now(timezone.utc).isoformat()))
+    conn.commit()
+
+
+def changed_keys(raw_conn, after: int, upto: int) -> dict:
+    # raw table -> keys inserted or replaced with after < seq <= upto
+    changes = {table: set() for table in ["meetings", "races", "race_details", "horse_results"]}
+    for table, key in raw_conn.execute("""
+        SELECT DISTINCT table_name, key FROM raw_changes WHERE seq > ? AND seq <= ?
+    """, (after, upto)):
+        changes[table].add(key)
+    return changes
+
+
+def prune_changes(raw_conn, seq: int):
+    # once the watermark is committed the log up to it is never read again; it gets a row per
+    # runner scraped, so left alone it grows with horse_results. The row at seq itself stays,
+    # so raw_seq never goes backwards past the watermark.
+    try:
+        with raw_conn:
+            pruned = raw_conn.execute("DELETE FROM raw_changes WHERE seq < ?", (seq,)).rowcount
+    except sqlite3.OperationalError as e:
+        # e.g. a scraper holding the write lock; the next run prunes it instead
+        print(f"Could not prune raw_changes: {e}")
+        return
+    if pruned:
+        print(f"Pruned {pruned} raw_changes rows below seq {seq}")
+
+
+def delete_keys(conn, table: str, key: str, ids):
+    conn.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT value FROM json_each(?))",
+                 (json.dumps([int(i) for i in ids]),))
+
+
+def unfeature(conn, race_ids):
+    # before their runners are replaced: the feature store needs the old ones to roll them back
+    if not race_ids or not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'feature_races'").fetchone():
+        return
+    conn.execute(CREATE_FEATURE_CHANGES)
+    conn.execute("""
+        INSERT INTO feature_changes (race_id, start, horse_id, jockey_id, trainer_id)
+        SELECT feature_races.race_id, feature_races.start, runners.horse_id, runners.jockey_id, runners.trainer_id
+        FROM feature_races LEFT JOIN runners ON runners.race_id = feature_races.race_id
+        WHERE feature_races.race_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps([int(i) for i in race_ids]),))
+    delete_keys(conn, "feature_races", "race_id", race_ids)
+    conn.commit()
+
+
+def load_tables(raw_conn, conn, dims, chunk_size, meeting_ids=None, race_ids=None, runner_race_ids=None, workers=1):
+    """Transform and append meetings, races and runners.
+
+    Each *_ids limits a table to those raw keys, after first deleting the rows
+    the processed db holds for them; None loads the whole raw table.
+    """
+    if meeting_ids is None or meeting_ids:
+        meetings = meetings_table(transform_meetings(raw_conn, meeting_ids), dims)
+        if meeting_ids is not None:
+            delete_keys(conn, "meetings", "meeting_id", meeting_ids)
+        meetings.to_sql("meetings", conn, if_exists="append", index=False)
+        print(f"Loaded {len(meetings)} meetings")
+
+    if race_ids is None or race_ids:
+        races = races_table(transform_races(raw_conn, race_ids))
+        if race_ids is not None:
+            delete_keys(conn, "races", "race_id", race_ids)
+        races.to_sql("races", conn, if_exists="append", index=False)
+        print(f"Loaded {len(races)} races")
+
+    if runner_race_ids is None or runner_race_ids:
+        # a race's runners are always replaced as a whole
+        if runner_race_ids is not None:
+            delete_keys(conn, "runners", "race_id", runner_race_ids)
+        runners = transform_horse_results(
+            raw_conn, chunk_size, runner_race_ids,
+            sink=lambda chunk: runners_table(chunk, dims).to_sql("runners", conn, if_exists="append", index=False),
+            workers=workers,
+        )
+        print(f"Loaded {runners} runners")
+
+    conn.commit()
+
+
+def build_processed_db(raw_conn, conn, chunk_size: int = 25000, workers=1):
+    """Transform the raw tables into the typed, dimension-keyed processed db.
+
+    The fact tables are rebuilt from scratch; dimension keys are kept.
+    """
+    if name_keyed_horses(conn):
+        # every runner gets its horse_id afresh anyway; the new ids are the raw identities
+        conn.execute("DROP TABLE horses")
+    create_schema(conn)
+    dims = dimensions(conn)
+    # read before transforming, so anything scraped during the build is picked up by the next incremental run
+    seq = raw_seq(raw_conn)
+
+    for table in ["runners", "races", "meetings", *FEATURE_TABLES]:
+        conn.execute(f"DROP TABLE IF EXISTS {table}" if table in FEATURE_TABLES else f"DELETE FROM {table}")
+
+    load_tables(raw_conn, conn, dims, chunk_size, workers=workers)
+
+    if seq is not None:
+        set_watermark(conn, seq)
+        prune_changes(raw_conn, seq)
+    conn.execute("ANALYZE")
+    print("Dimensions: " + ", ".join(f"{table} {len(dim.ids)}" for table, dim in dims.items()))
+
+
+def update_processed_db(raw_conn, conn, chunk_size: int = 25000, workers=1):
+    """Bring the processed db up to date with only the raw rows inserted or
+    replaced since the last run, as logged in raw_changes.
+
+    Falls back to a full build when there is no watermark yet. The watermark
+    only moves once everything is loaded, so an interrupted run is simply
+    redone next time; raw_changes below it is pruned only after that.
+    """
+    create_schema(conn)
+    seq = raw_seq(raw_conn)
+    watermark = get_watermark(conn)
+    if seq is None or watermark is None or name_keyed_horses(conn):
+        print("No watermark yet (or no raw_changes log in the raw db, or horses still keyed on name), "
+              "doing a full build")
+        return build_processed_db(raw_conn, conn, chunk_size, workers)
+
+    if seq == watermark:
+        print(f"Up to date at raw_changes seq {seq}")
+        prune_changes(raw_conn, seq)
+        return
+
+    changes = changed_keys(raw_conn, watermark, seq)
+    print(f"raw_changes {watermark} -> {seq}: " + ", ".join(f"{table} {len(keys)}" for table, keys in changes.items()))
+
+    dims = dimensions(conn)
+    # no longer featured, so the next feature_store.py run refeatures them
+    unfeature(conn, changes["races"] | changes["race_details"] | changes["horse_results"])
+    load_tables(
+        raw_conn, conn, dims, chunk_size,
+        meeting_ids=changes["meetings"],
+        race_ids=changes["races"] | changes["race_details"],
+        runner_race_ids=changes["horse_results"],
+        workers=workers,
+    )
+
+    set_watermark(conn, seq)
+    prune_changes(raw_conn, seq)
+    conn.execute("ANALYZE")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the typed, dimension-keyed processed database")
+    parser.add_argument("--raw", default=RAW_DB, help="raw scraper database")
+    parser.add_argument("--out", default=PROCESSED_DB, help="processed database to (re)build")
+    parser.add_argument("--chunk-size", type=int, default=25000, help="horse_results rows per chunk")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only transform raw rows scraped since the last run")
+    parser.add_argument("--workers", type=int, default=1, help="processes transforming horse_results (0 = one per core)")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    raw_conn = sqlite3.connect(args.raw)
+    conn = sqlite3.connect(args.out)
+    if args.incremental:
+        update_processed_db(raw_conn, conn, args.chunk_size, workers)
+    else:
+        build_processed_db(raw_conn, conn, args.chunk_size, workers)
+        conn.execute("VACUUM")
+    conn.close()
+    raw_conn.close()
+
+    print(f"{args.raw}: {os.path.getsize(args.raw) / 1024**2:.1f} MB -> "
+          f"{args.out}: {os.path.getsize(args.out) / 1024**2:.1f} MB")
@@ -1,6 +1,9 @@
 import sqlite3
+import json
+import numpy as np
 import pandas as pd
 import re
+from functools import lru_cache
 
 pd.set_option('display.max_rows', 500)
 
@@ -72,8 +75,59 @@ def parse_event_class(raw: str) -> dict:
         "race_class":      first(CLASS_RE),
     }
 
-def transform_races(raw_conn: pd.DataFrame) -> pd.DataFrame:
-    df = pd.read_sql("SELECT * FROM races LEFT JOIN race_details ON races.race_id = race_details.race_id", raw_conn)
+
+EVENT_CLASS_COLS = ["age_restriction", "sex_restriction", "race_type", "race_class"]
+PRIZE_COLS = ["total_prize", "first_prize", "second_prize", "third_prize"]
+
+
+@lru_cache(maxsize=None)
+def classify_event_class(raw: str) -> tuple:
+    # a few thousand distinct event classes across all races, each only parsed once per process
+    parsed = parse_event_class(raw)
+    return tuple(parsed[col] for col in EVENT_CLASS_COLS)
+
+
+def by_distinct(values, parse):
+    """parse() run on the distinct non-null values only, mapped back onto every row.
+
+    parse gets a Series of the distinct values and returns a Series / DataFrame
+    in the same order; rows with a missing value come back as NaN.
+    """
+    codes, uniques = pd.factorize(values)
+    return parse(pd.Series(uniques, dtype=object)).reindex(codes)
+
+
+def classify_event_classes(event_class: pd.Series) -> pd.DataFrame:
+    # astype(str) as before, so a missing class is parsed as the text "None"
+    parsed = by_distinct(
+        event_class.astype(str),
+        lambda uniques: pd.DataFrame([classify_event_class(raw) for raw in uniques], columns=EVENT_CLASS_COLS),
+    )
+    return parsed.set_axis(event_class.index)
+
+
+def clean_prizes(prizes: pd.DataFrame) -> pd.DataFrame:
+    # one pass over all four columns, which share most of their values ("$35,000")
+    values = prizes.to_numpy(dtype=object).ravel()
+    cleaned = by_distinct(values, lambda uniques: uniques.replace(r'[\$,]', '', regex=True)).to_numpy()
+    cleaned = np.where(pd.isna(values), values, cleaned)       # missing prizes stay as they were
+    return pd.DataFrame(cleaned.reshape(prizes.shape), index=prizes.index, columns=prizes.columns)
+
+
+def parse_times(times: pd.Series, pattern: str) -> pd.DataFrame:
+    # "1:09.85" (+ " at 600m") -> seconds (and metres), extracted once per distinct value
+    parts = by_distinct(times, lambda uniques: uniques.str.extract(pattern)).set_axis(times.index)
+    return parts.apply(pd.to_numeric, errors='coerce')
+
+def transform_races(raw_conn: pd.DataFrame, race_ids=None) -> pd.DataFrame:
+    query = "SELECT * FROM races LEFT JOIN race_details ON races.race_id = race_details.race_id"
+    params = ()
+    if race_ids is not None:
+        # incremental runs: only these races
+        query += " WHERE races.race_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(race_ids)),)
+
+    df = pd.read_sql(query, raw_conn, params=params)
     
     df = df.loc[:, ~df.columns.duplicated()]    # removes duplicated race_id column
     df = df.replace("", None)
@@ -97,41 +151,25 @@ def transform_races(raw_conn: pd.DataFrame) -> pd.DataFrame:
     # remove as it is 100% the same as track_type
     df = df.drop(columns='track_condition_surface')
     
-    # total_prize
-    df['total_prize'] = df['total_prize'].replace('[\$,]', '', regex=True)
-
-    # first_prize
-    df['first_prize'] = df['first_prize'].replace('[\$,]', '', regex=True)
-    
-    # second_prize
-    df['second_prize'] = df['second_prize'].replace('[\$,]', '', regex=True)
-
-    # third_prize
-    df['third_prize'] = df['third_prize'].replace('[\$,]', '', regex=True)
+    # total_prize, first_prize, second_prize, third_prize
+    df[PRIZE_COLS] = clean_prizes(df[PRIZE_COLS])
     
     # winning_time
-    parts = df['winning_time'].str.extract(r'(\d+):(\d+\.\d+)')
-
-    minutes = pd.to_numeric(parts[0], errors='coerce')
-    seconds = pd.to_numeric(parts[1], errors='coerce')
+    parts = parse_times(df['winning_time'], r'(\d+):(\d+\.\d+)')
     
-    df['winning_time'] = minutes * 60 + seconds 
+    df['winning_time'] = parts[0] * 60 + parts[1]
 
     # sectional_time
-    parts = df['sectional_time'].str.extract(r'(\d+):(\d+\.\d+)\s+at\s+(\d+)m')
-
-    minutes = pd.to_numeric(parts[0], errors='coerce')
-    seconds = pd.to_numeric(parts[1], errors='coerce')
-    distance = pd.to_numeric(parts[2], errors='coerce')
+    parts = parse_times(df['sectional_time'], r'(\d+):(\d+\.\d+)\s+at\s+(\d+)m')
 
-    df['sectional_time'] = minutes * 60 + seconds          
-    df['sectional_distance']  = distance.astype('Int64')
+    df['sectional_time'] = parts[0] * 60 + parts[1]
+    df['sectional_distance']  = parts[2].astype('Int64')
     
     # track_rail_info
     df['track_rail_info'] = df['track_rail_info'].str.lower()
     
     # event_class
-    parsed = df['event_class'].astype(str).apply(parse_event_class).apply(pd.Series)
+    parsed = classify_event_classes(df['event_class'])
     df = pd.concat([df, parsed], axis=1)
 
     print(df.columns)
@@ -143,5 +181,6 @@ def transform_races(raw_conn: pd.DataFrame) -> pd.DataFrame:
     
     return df
 
-raw_conn = sqlite3.connect('../raw_racing_data.db')
-transform_races(raw_conn)
\ No newline at end of file
+if __name__ == "__main__":
+    raw_conn = sqlite3.connect('../raw_racing_data.db')
+    transform_races(raw_conn)
\ No newline at end of file
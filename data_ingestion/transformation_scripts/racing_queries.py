@@ -0,0 +1,153 @@
+import argparse
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from processed_db import PROCESSED_DB
+
+
+# fixed SQL text, so sqlite3's per-connection statement cache keeps each one prepared
+RACE_CARD = """
+SELECT meetings.date, venues.name AS venue, races.race_id, races.event_number, races.name AS race,
+       races.distance, races.start_time, races.track_condition_overall,
+       runners.running_number, runners.is_emergency_runner, runners.barrier,
+       horses.name AS horse, jockeys.name AS jockey, trainers.name AS trainer,
+       runners.adjusted_weight, runners.sp, runners.finish_position, runners.margin
+FROM meetings
+JOIN venues ON venues.venue_id = meetings.venue_id
+JOIN races ON races.meeting_id = meetings.meeting_id
+JOIN runners ON runners.race_id = races.race_id
+LEFT JOIN horses ON horses.horse_id = runners.horse_id
+LEFT JOIN jockeys ON jockeys.jockey_id = runners.jockey_id
+LEFT JOIN trainers ON trainers.trainer_id = runners.trainer_id
+WHERE meetings.date = ? AND (? IS NULL OR venues.name = ?)
+ORDER BY venues.name, races.event_number, runners.is_emergency_runner, runners.running_number
+"""
+
+HORSE_FORM = """
+SELECT meetings.date, venues.name AS venue, races.race_id, races.name AS race, races.distance,
+       races.race_class, races.track_condition_overall, runners.horse_id,
+       runners.barrier, jockeys.name AS jockey, trainers.name AS trainer, runners.adjusted_weight,
+       runners.finish_position, runners.margin, runners.sp
+FROM runners
+JOIN races ON races.race_id = runners.race_id
+JOIN meetings ON meetings.meeting_id = races.meeting_id
+JOIN venues ON venues.venue_id = meetings.venue_id
+LEFT JOIN jockeys ON jockeys.jockey_id = runners.jockey_id
+LEFT JOIN trainers ON trainers.trainer_id = runners.trainer_id
+WHERE runners.horse_id IN (SELECT horse_id FROM horses WHERE name = ?)
+ORDER BY meetings.date DESC, races.start_time DESC
+LIMIT ?
+"""
+
+# jockey / trainer -> their runs between two dates
+PERSON_RUNS = {
+    person: f"""
+SELECT meetings.date, venues.name AS venue, races.race_id, races.event_number, races.name AS race,
+       horses.name AS horse, runners.finish_position, runners.margin, runners.sp
+FROM runners
+JOIN races ON races.race_id = runners.race_id
+JOIN meetings ON meetings.meeting_id = races.meeting_id
+JOIN venues ON venues.venue_id = meetings.venue_id
+LEFT JOIN horses ON horses.horse_id = runners.horse_id
+WHERE runners.{person}_id = (SELECT {person}_id FROM {person}s WHERE name = ?)
+  AND meetings.date BETWEEN ? AND ?
+ORDER BY meetings.date, races.start_time
+"""
+    for person in ["jockey", "trainer"]
+}
+
+
+class RacingQueries:
+    """Read-only lookups over the processed db, with an LRU cache of results.
+
+    Before each lookup the connection's PRAGMA data_version is checked; it
+    changes whenever any other connection (processed_db.py, feature_store.py)
+    has committed, and the whole cache is dropped then. A cached answer is
+    therefore always what the query would return right now.
+
+    Results are tuples of sqlite3.Row, shared between callers; as_frame()
+    turns one into a DataFrame. Safe to share between threads.
+    """
+
+    def __init__(self, db_path=PROCESSED_DB, cache_size=1024):
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()      # (sql, params) -> rows, least recently used first
+        self.cache_size = cache_size
+        self.data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def query(self, sql: str, params: tuple = ()) -> tuple:
+        key = (sql, params)
+        with self.lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self.data_version:
+                if self.cache:
+                    self.invalidations += 1
+                self.cache.clear()
+                self.data_version = version
+
+            rows = self.cache.get(key)
+            if rows is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return rows
+
+            self.misses += 1
+            rows = tuple(self.conn.execute(sql, params))
+            self.cache[key] = rows
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return rows
+
+    def race_card(self, date: str, venue: str = None) -> tuple:
+        """Every runner of every race on `date` (YYYY-MM-DD), optionally at one venue."""
+        venue = venue.lower() if venue else None
+        return self.query(RACE_CARD, (date, venue, venue))
+
+    def horse_form(self, horse: str, last: int = 10) -> tuple:
+        """A horse's last `last` runs, newest first. Horses sharing the name are
+        all included; horse_id tells them apart."""
+        return self.query(HORSE_FORM, (horse.lower(), last))
+
+    def jockey_runs(self, jockey: str, start_date: str = "0000-01-01", end_date: str = "9999-12-31") -> tuple:
+        return self.query(PERSON_RUNS["jockey"], (jockey.lower(), start_date, end_date))
+
+    def trainer_runs(self, trainer: str, start_date: str = "0000-01-01", end_date: str = "9999-12-31") -> tuple:
+        return self.query(PERSON_RUNS["trainer"], (trainer.lower(), start_date, end_date))
+
+    def summary(self) -> str:
+        return (f"cache: {self.hits} hits, {self.misses} misses, {len(self.cache)}/{self.cache_size} entries, "
+                f"{self.invalidations} invalidations")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def as_frame(rows: tuple) -> pd.DataFrame:
+    return pd.DataFrame([tuple(row) for row in rows], columns=rows[0].keys() if rows else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up a race card in the processed database")
+    parser.add_argument("--db", default=PROCESSED_DB, help="processed database")
+    parser.add_argument("--date", required=True, help="race day (YYYY-MM-DD)")
+    parser.add_argument("--venue", help="only this venue")
+    args = parser.parse_args()
+
+    queries = RacingQueries(args.db)
+    for attempt in ["uncached", "cached"]:
+        start = time.perf_counter()
+        rows = queries.race_card(args.date, args.venue)
+        print(f"{attempt}: {len(rows)} runners in {(time.perf_counter() - start) * 1e6:.0f} µs")
+    print(as_frame(rows).to_string())
+    print(queries.summary())
+    queries.close()
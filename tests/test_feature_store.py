@@ -0,0 +1,122 @@
+import os
+import random
+import sqlite3
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "data_ingestion", "transformation_scripts"))
+
+from feature_store import update_feature_store
+from processed_db import create_schema, unfeature
+
+
+def make_processed_db(path, days=40, races_per_day=4, seed=1):
+    # a small processed db: a few dozen horses, jockeys and trainers meeting again and again
+    r = random.Random(seed)
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    for day in range(days):
+        date = (pd.Timestamp("2015-01-01") + pd.Timedelta(days=day)).strftime("%Y-%m-%d")
+        conn.execute("INSERT INTO meetings (meeting_id, venue_id, date) VALUES (?, 1, ?)", (day + 1, date))
+        for event in range(1, races_per_day + 1):
+            race_id = (day + 1) * 10 + event
+            # one race a day shares its start with the previous one
+            start = f"{date}T{max(event, 2):02d}:00:00.000Z"
+            conn.execute("INSERT INTO races (race_id, meeting_id, event_number, start_time, place_winners, "
+                         "is_abandoned) VALUES (?, ?, ?, ?, 3, ?)", (race_id, day + 1, event, start,
+                                                                       int(r.random() < 0.03)))
+            field = r.sample(range(1, 41), 8)
+            positions = r.sample(range(1, 9), 8)
+            for number, (horse, position) in enumerate(zip(field, positions), 1):
+                scratched = r.random() < 0.1
+                conn.execute("""
+                    INSERT INTO runners (race_id, running_number, is_emergency_runner, horse_id, jockey_id,
+                                         trainer_id, finish_position, margin)
+                    VALUES (?, ?, 0, ?, ?, ?, ?, ?)
+                """, (race_id, number, horse, r.randint(1, 12), r.choice([r.randint(1, 8), None]),
+                      None if scratched else position, None if scratched else round(r.random() * 6, 1)))
+    conn.commit()
+    return conn
+
+
+def store(conn) -> tuple:
+    features = pd.read_sql("SELECT * FROM runner_features", conn)
+    state = pd.read_sql("SELECT * FROM entity_state", conn)
+    featured = pd.read_sql("SELECT * FROM feature_races", conn)
+    return (features.sort_values(["race_id", "running_number", "is_emergency_runner"]).reset_index(drop=True),
+            state.sort_values(["entity", "entity_id"]).reset_index(drop=True),
+            featured.sort_values("race_id").reset_index(drop=True))
+
+
+def assert_matches_rebuild(conn, tmp_path):
+    rebuilt = sqlite3.connect(tmp_path / "rebuilt.db")
+    conn.backup(rebuilt)
+    update_feature_store(rebuilt, rebuild=True)
+    for ours, theirs in zip(store(conn), store(rebuilt)):
+        pd.testing.assert_frame_equal(ours, theirs, check_dtype=False)
+    assert conn.execute("SELECT count(*) FROM feature_changes").fetchone()[0] == 0
+
+
+def test_point_in_time(tmp_path):
+    conn = make_processed_db(tmp_path / "processed.db")
+    update_feature_store(conn, batch_races=7)
+    features = store(conn)[0]
+
+    runs = pd.read_sql("""
+        SELECT runners.race_id, running_number, horse_id, jockey_id, finish_position, start_time AS start
+        FROM runners JOIN races USING (race_id)
+        WHERE finish_position IS NOT NULL AND is_abandoned = 0
+    """, conn)
+    checked = features.merge(pd.read_sql("SELECT race_id, running_number, horse_id, jockey_id, start_time AS start "
+                                         "FROM runners JOIN races USING (race_id)", conn),
+                             on=["race_id", "running_number"])
+    for row in checked.itertuples():
+        # runs strictly before this race's start; races starting together don't see each other
+        before = runs[(runs["horse_id"] == row.horse_id) & (runs["start"] < row.start)]
+        assert row.horse_runs == len(before)
+        if len(before):
+            assert row.horse_win_rate == (before["finish_position"] == 1).mean()
+            last = pd.Timestamp(before["start"].max())
+            assert row.horse_days_since == (pd.Timestamp(row.start) - last) / pd.Timedelta(days=1)
+        jockey_before = runs[(runs["jockey_id"] == row.jockey_id) & (runs["start"] < row.start)]
+        assert row.jockey_runs == len(jockey_before)
+
+
+def test_late_race_matches_rebuild(tmp_path, capsys):
+    conn = make_processed_db(tmp_path / "processed.db")
+    # results for a few mid-range races come in after later races were featured
+    late = [r for r, in conn.execute("SELECT race_id FROM races WHERE meeting_id IN (12, 25) AND event_number <= 2")]
+    conn.execute("CREATE TEMP TABLE held AS SELECT * FROM runners WHERE race_id IN (%s)" % ",".join("?" * len(late)),
+                 late)
+    conn.execute("DELETE FROM runners WHERE race_id IN (SELECT race_id FROM held)")
+    conn.commit()
+    update_feature_store(conn)
+    # races without runners yet wait, rather than moving the watermark
+    assert conn.execute("SELECT count(*) FROM feature_races WHERE race_id IN (SELECT race_id FROM held)").fetchone()[0] == 0
+
+    conn.execute("INSERT INTO runners SELECT * FROM held")
+    conn.commit()
+    capsys.readouterr()
+    update_feature_store(conn)
+    assert "4 late and 0 reloaded races: rolled back to 2015-01-12T02:00:00.000Z" in capsys.readouterr().out
+    assert_matches_rebuild(conn, tmp_path)
+
+
+def test_reloaded_race_matches_rebuild(tmp_path, capsys):
+    conn = make_processed_db(tmp_path / "processed.db")
+    update_feature_store(conn)
+
+    # processed_db.py --incremental reloads featured races: new results, another jockey, one race emptied
+    reloaded = [r for r, in conn.execute("SELECT race_id FROM races WHERE meeting_id IN (8, 30) ORDER BY race_id")]
+    unfeature(conn, reloaded)
+    for race_id in reloaded[:-1]:
+        conn.execute("UPDATE runners SET finish_position = 1 + finish_position % 8 WHERE race_id = ?", (race_id,))
+        conn.execute("UPDATE runners SET jockey_id = 12 WHERE race_id = ? AND running_number = 1", (race_id,))
+    conn.execute("DELETE FROM runners WHERE race_id = ?", (reloaded[-1],))
+    conn.commit()
+
+    capsys.readouterr()
+    update_feature_store(conn)
+    assert "8 reloaded races: rolled back to 2015-01-08T02:00:00.000Z" in capsys.readouterr().out
+    assert_matches_rebuild(conn, tmp_path)
@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "data_ingestion", "transformation_scripts"))
+
+from processed_db import create_schema
+from racing_queries import RacingQueries
+
+
+def make_processed_db(path):
+    # names are stored lowercased, as the transforms leave them
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.execute("INSERT INTO venues (venue_id, name) VALUES (1, 'randwick')")
+    conn.execute("INSERT INTO meetings (meeting_id, venue_id, date) VALUES (10, 1, '2015-01-01')")
+    conn.execute("INSERT INTO races (race_id, meeting_id, event_number) VALUES (100, 10, 1)")
+    conn.execute("INSERT INTO horses (horse_id, name) VALUES (1, 'pride of jenni')")
+    conn.executemany("INSERT INTO runners (race_id, running_number, is_emergency_runner, horse_id) VALUES (?, ?, 0, ?)",
+                     [(100, 1, 1), (100, 2, None)])
+    conn.commit()
+    conn.close()
+
+
+def test_race_card_venue_ignores_case(tmp_path):
+    path = tmp_path / "processed.db"
+    make_processed_db(path)
+    queries = RacingQueries(path)
+
+    assert len(queries.race_card("2015-01-01", "Randwick")) == 2
+    assert len(queries.race_card("2015-01-01", "randwick")) == 2
+    assert len(queries.race_card("2015-01-01")) == 2
+    assert len(queries.race_card("2015-01-01", "Flemington")) == 0
+    queries.close()